@@ -0,0 +1,56 @@
+import sys
+import json
+
+from time import perf_counter
+from typing import Callable, List
+
+from aiocraft.util.helpers import parse_chat
+
+from treepuncher.capture import read_capture
+from treepuncher.events.chat import (
+	ChatEvent, MessageType, CHAT_MESSAGE_MATCHER, WHISPER_MATCHER, JOIN_LEAVE_MATCHER, REMOVE_COLOR_FORMATS
+)
+
+SAMPLE = [
+	"<Steve> anyone selling diamonds?",
+	"Alex joined the game",
+	"Herobrine left the game",
+	"Notch whispers: meet me at spawn",
+	"[Server] Restarting in 5 minutes",
+	"§6[Broadcast] §fVote for us and get rewards!",
+	"Welcome back! You have 3 unread mails",
+	"Steve was slain by Zombie",
+]
+
+def legacy(raw:str):
+	# how every message was handled before: eager, three sequential searches
+	text = REMOVE_COLOR_FORMATS.sub("", parse_chat(raw))
+	if CHAT_MESSAGE_MATCHER.search(text):
+		return MessageType.CHAT
+	if WHISPER_MATCHER.search(text):
+		return MessageType.WHISPER
+	if JOIN_LEAVE_MATCHER.search(text):
+		return MessageType.JOIN
+	return MessageType.SYSTEM
+
+def load(path:str) -> List[str]:
+	if path.endswith(".tpcap"):  # chat packets out of a capture
+		_, packets = read_capture(path, only={"PacketChat"})
+		return [ p.message for _, p in packets ]
+	with open(path) as f:  # one raw chat message per line, json components or plain text
+		return [ line.rstrip("\n") for line in f if line.strip() ]
+
+def measure(label:str, corpus:List[str], fn:Callable[[str], object]):
+	start = perf_counter()
+	for raw in corpus:
+		fn(raw)
+	elapsed = perf_counter() - start
+	print(f"{label:<32} {len(corpus) / elapsed:>12.0f} msg/s")
+
+if __name__ == "__main__":
+	corpus = load(sys.argv[1]) if len(sys.argv) > 1 else [ json.dumps({"text": t}) for t in SAMPLE ] * 25000
+	print(f"{len(corpus)} messages")
+	measure("legacy eager parsing", corpus, legacy)
+	measure("lazy, fields never read", corpus, lambda raw: ChatEvent(raw))
+	measure("lazy, only text read", corpus, lambda raw: ChatEvent(raw).text)
+	measure("lazy, classified", corpus, lambda raw: ChatEvent(raw).type)
@@ -0,0 +1,55 @@
+import os
+import sys
+import random
+import tempfile
+
+from time import perf_counter
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from treepuncher.storage import StorageDriver
+from treepuncher.serialization import CODECS, Codec
+
+def payloads() -> Dict[str, Any]:
+	rng = random.Random(42)
+	return {
+		"coordinate history": [
+			[ rng.uniform(-3e4, 3e4), rng.uniform(0, 256), rng.uniform(-3e4, 3e4) ]
+			for _ in range(500)
+		],
+		"player stats": {
+			f"player_{i}": {
+				"kills": rng.randint(0, 5000),
+				"deaths": rng.randint(0, 5000),
+				"playtime": rng.random() * 1e6,
+				"last_seen": datetime(2023, 1, 1) + timedelta(seconds=rng.randint(0, 10**7)),
+			}
+			for i in range(200)
+		},
+		"whitelist": [ f"player_{i}" for i in range(300) ],
+	}
+
+def measure(count:int, fn) -> float:
+	start = perf_counter()
+	for _ in range(count):
+		fn()
+	return (perf_counter() - start) / count * 1e6
+
+def database_size(codec:Codec, val:Any, docs:int) -> int:
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, "bench.session")
+		driver = StorageDriver(path, journal_mode="delete")
+		driver.addon_storage("bench", codec=codec).put_many({ f"doc-{i}": val for i in range(docs) })
+		driver.close()
+		return os.path.getsize(path)
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	for name, val in payloads().items():
+		print(f"{name}:")
+		for tag, codec in CODECS.items():
+			data = codec.encode(val)
+			enc = measure(count, lambda: codec.encode(val))
+			dec = measure(count, lambda: codec.decode(data))
+			size = database_size(codec, val, 100)
+			print(f"  {tag:<6} encode {enc:>9.1f} us    decode {dec:>9.1f} us    value {len(data):>7} B    db (100 docs) {size / 1024:>8.1f} KiB")
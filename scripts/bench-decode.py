@@ -0,0 +1,90 @@
+import io
+import os
+import argparse
+import tempfile
+
+from time import perf_counter
+from typing import Dict, List, Set, Tuple
+
+from aiocraft.packet import Packet
+
+from treepuncher import Treepuncher
+from treepuncher.capture import CAPTURE_MAGIC, _HEADER, _RECORD, _registry
+
+CONFIG = """[Treepuncher]
+server = localhost:25565
+process_world = {world}
+track_vehicles = {vehicles}
+"""
+
+def load(path:str) -> Tuple[int, List[Tuple[int, bytes]]]:
+	"""raw (packet id, payload) records of a capture, so only decoding gets timed"""
+	with open(path, "rb") as f:
+		magic, proto = _HEADER.unpack(f.read(_HEADER.size))
+		if magic != CAPTURE_MAGIC:
+			raise ValueError(f"'{path}' is not a packet capture")
+		records = []
+		while True:
+			head = f.read(_RECORD.size)
+			if len(head) < _RECORD.size:
+				return proto, records
+			_, pid, payload_len = _RECORD.unpack(head)
+			records.append((pid, f.read(payload_len)))
+
+def decode_times(proto:int, records:List[Tuple[int, bytes]], rounds:int) -> Dict[str, Tuple[int, float]]:
+	"""packet count and best total decode time of each packet type"""
+	registry = _registry(proto)
+	res : Dict[str, Tuple[int, float]] = {}
+	for _ in range(rounds):
+		times : Dict[str, float] = {}
+		counts : Dict[str, int] = {}
+		for pid, payload in records:
+			cls = registry.get(pid)
+			if cls is None:
+				continue
+			start = perf_counter()
+			cls.deserialize(proto, io.BytesIO(payload))
+			times[cls.__name__] = times.get(cls.__name__, 0.0) + perf_counter() - start
+			counts[cls.__name__] = counts.get(cls.__name__, 0) + 1
+		for name, t in times.items():
+			if name not in res or t < res[name][1]:
+				res[name] = (counts[name], t)
+	return res
+
+def whitelist(world:bool, vehicles:bool, ignored:Set[str]) -> Set[str]:
+	"""packet types a client with this configuration gets decoded"""
+	with tempfile.TemporaryDirectory() as tmp:
+		config = os.path.join(tmp, "decode.ini")
+		with open(config, "w") as f:
+			f.write(CONFIG.format(world=world, vehicles=vehicles))
+		client = Treepuncher("decode", config_file=config, online_mode=False, session_file=os.path.join(tmp, "decode.session"))
+		names = set(p.__name__ for p in client.callback_keys(filter=Packet)) - ignored
+		client.storage.close()
+		return names
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="time packet decoding of a capture, for each packet type and for some client configurations")
+	parser.add_argument('capture', help='capture file, record one setting capture_file in client config')
+	parser.add_argument('--world', action='store_true', help='clients also process world data')
+	parser.add_argument('--ignore', default='', help='comma separated packet names, like the ignore_packets option')
+	parser.add_argument('--rounds', type=int, default=5, help='decode everything this many times, keep best times')
+	parser.add_argument('--top', type=int, default=15, help='how many packet types to list')
+	args = parser.parse_args()
+
+	proto, records = load(args.capture)
+	times = decode_times(proto, records, args.rounds)
+	total = sum(t for _, t in times.values())
+	print(f"{len(records)} packets, protocol {proto}, {total * 1000:.1f}ms to decode everything")
+	for name, (count, t) in sorted(times.items(), key=lambda x: x[1][1], reverse=True)[:args.top]:
+		print(f"  {name:<32} {count:>8} packets {t * 1000:>9.2f}ms {t / count * 1e6:>8.2f}us each")
+
+	ignored = set(n.strip() for n in args.ignore.split(',') if n.strip())
+	for label, vehicles, skip in (
+		("default", True, set()),
+		("track_vehicles = false", False, set()),
+		("track_vehicles = false, ignore_packets", False, ignored),
+	):
+		decoded = whitelist(args.world, vehicles, skip)
+		spent = sum(t for name, (_, t) in times.items() if name in decoded)
+		count = sum(c for name, (c, _) in times.items() if name in decoded)
+		print(f"{label}: {count} packets decoded in {spent * 1000:.1f}ms ({spent / total * 100 if total else 0:.0f}% of decoding time)")
@@ -0,0 +1,81 @@
+import sys
+import asyncio
+import logging
+
+from time import perf_counter
+from configparser import ConfigParser
+
+from aiocraft.client import AbstractMinecraftClient
+from aiocraft.proto.play.clientbound import PacketKeepAlive
+from aiocraft.proto.play.serverbound import PacketKeepAlive as PacketKeepAliveResponse
+
+from treepuncher.scaffold import Scaffold
+from treepuncher.traits import CallbackQueue, OverflowPolicy
+from treepuncher.metrics import Histogram
+
+class FloodPacket:  # dispatch only looks at types, no need for a real packet
+	pass
+
+class FakeDispatcher:
+	"""delivers packets at a fixed rate, as if they were arriving from the network"""
+	proto = 760
+	connected = True
+
+	def __init__(self, packets:list, rate:float, latency:Histogram):
+		self._packets = packets
+		self._interval = 1.0 / rate
+		self._arrivals = {}
+		self._latency = latency
+
+	def promote(self, _):
+		pass
+
+	async def packets(self):
+		start = perf_counter()
+		for i, packet in enumerate(self._packets):
+			arrival = start + i * self._interval
+			if perf_counter() < arrival:
+				await asyncio.sleep(arrival - perf_counter())
+			if isinstance(packet, PacketKeepAlive):
+				self._arrivals[packet.keepAliveId] = arrival
+			yield packet
+
+	async def write(self, packet):
+		if isinstance(packet, PacketKeepAliveResponse):  # measured from network arrival, not from dispatch
+			self._latency.observe(perf_counter() - self._arrivals[packet.keepAliveId])
+
+class NoNetwork(AbstractMinecraftClient):
+	def __init__(self, *args, **kwargs):
+		pass  # never connects anywhere
+
+class FloodClient(Scaffold, NoNetwork):
+	def __init__(self, backlog:int):
+		self.config = ConfigParser()
+		self.config.read_dict({"Treepuncher": {"packet_backlog": str(backlog)}})
+		self.logger = logging.getLogger("flood")
+		super().__init__()
+
+async def flood(backlog:int, count:int, rate:float, keep_alive_every:int) -> Histogram:
+	latency = Histogram(f"packet_backlog={backlog}")
+	client = FloodClient(backlog)
+	queue = CallbackQueue("slow-addon", maxsize=64, concurrency=1, policy=OverflowPolicy.BLOCK)
+
+	async def slow_handler(_):
+		await asyncio.sleep(0.001)  # an addon which can't keep up with the flood
+
+	client.register(FloodPacket, slow_handler, queue=queue)
+	packets = [
+		PacketKeepAlive(keepAliveId=i) if i % keep_alive_every == 0 else FloodPacket()
+		for i in range(count)
+	]
+	client.dispatcher = FakeDispatcher(packets, rate, latency)
+	await client._play()
+	await queue.close()
+	return latency
+
+async def main(count:int):
+	for backlog in (0, 4096, 65536):
+		print(await flood(backlog, count, rate=5000, keep_alive_every=250))
+
+if __name__ == "__main__":
+	asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,49 @@
+import os
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+from time import perf_counter
+
+from treepuncher import Treepuncher
+from treepuncher.capture import ReplayDispatcher
+
+CONFIG = """[Treepuncher]
+server = localhost:25565
+process_world = {world}
+world_decode_workers = {workers}
+"""
+
+async def replay(path:str, speed:float, world:bool, workers:int, trace:bool):
+	with tempfile.TemporaryDirectory() as tmp:
+		config = os.path.join(tmp, "replay.ini")
+		with open(config, "w") as f:
+			f.write(CONFIG.format(world=world, workers=workers))
+		client = Treepuncher("replay", config_file=config, online_mode=False, session_file=os.path.join(tmp, "replay.session"))
+		client.dispatcher = ReplayDispatcher(path, speed=speed)
+		if trace:
+			tracemalloc.start()
+		start = perf_counter()
+		await client._play()
+		await client.join_callbacks()
+		total = perf_counter() - start
+		print(client.dispatcher.report())
+		print(f"end to end, callbacks included: {total:.2f}s")
+		if trace:
+			current, peak = tracemalloc.get_traced_memory()
+			print(f"memory: {current / 2**20:.1f} MiB retained, {peak / 2**20:.1f} MiB peak")
+		if world:
+			print(f"world: {client.world.stats()}")
+		print(f"tablist: {len(client.tablist)} players")
+		await client.close_queues()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="replay a packet capture through treepuncher handlers")
+	parser.add_argument('capture', help='capture file, record one setting capture_file in client config')
+	parser.add_argument('--speed', type=float, default=0.0, help='1.0 keeps recorded timing, 0 goes as fast as possible')
+	parser.add_argument('--world', action='store_true', help='also process world data')
+	parser.add_argument('--workers', type=int, default=0, help='chunk decoding workers')
+	parser.add_argument('--memory', action='store_true', help='trace memory allocations, slows everything down')
+	args = parser.parse_args()
+	asyncio.run(replay(args.capture, args.speed, args.world, args.workers, args.memory))
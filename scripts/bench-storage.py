@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import tempfile
+
+from time import perf_counter
+from typing import Callable
+
+from treepuncher.storage import StorageDriver
+
+def legacy_put(driver:StorageDriver, table:str, key:str, val):
+	# how documents were written before upserts: two statements and a commit per put
+	with driver.backend.pool.connection() as db:
+		cur = db.cursor()
+		cur.execute(f"DELETE FROM {table} WHERE name = ?", (key,))
+		cur.execute(f"INSERT INTO {table} VALUES (?, ?, 'json')", (key, json.dumps(val, default=str)))
+		db.commit()
+
+def measure(count:int, fn:Callable[[int], None]) -> float:
+	start = perf_counter()
+	for i in range(count):
+		fn(i)
+	return count / (perf_counter() - start)
+
+def bench(label:str, count:int, legacy:bool = False, **kwargs):
+	with tempfile.TemporaryDirectory() as tmp:
+		driver = StorageDriver(os.path.join(tmp, "bench.session"), **kwargs)
+		storage = driver.addon_storage("bench")
+		if legacy:
+			put = lambda i: legacy_put(driver, storage.table, f"player-{i % 100}", {"count": i, "pos": [i, 64, -i]})
+		else:
+			put = lambda i: storage.put(f"player-{i % 100}", {"count": i, "pos": [i, 64, -i]})
+		puts = measure(count, put)
+		gets = measure(count, lambda i: storage.get(f"player-{i % 100}"))
+		driver.close()
+	print(f"{label:<32} put {puts:>10.0f} op/s    get {gets:>10.0f} op/s")
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	bench("rollback journal, delete+insert", count, legacy=True, journal_mode="delete", synchronous="full")
+	bench("rollback journal, upsert", count, journal_mode="delete", synchronous="full")
+	bench("wal, synchronous=full", count, journal_mode="wal", synchronous="full")
+	bench("wal, synchronous=normal", count, journal_mode="wal", synchronous="normal")
+	bench("wal, write-behind", count, journal_mode="wal", synchronous="normal", write_behind=True)
@@ -1,21 +1,16 @@
-import sqlite3
+import sys
 
-def migrate_old_documents_to_namespaced_documents(db:str):
-	db = sqlite3.connect(db)
+from treepuncher.storage import StorageDriver
 
-	values = db.cursor().execute("SELECT * FROM documents", ()).fetchall();
-
-	for k,v in values:
-		if "_" in k:
-			addon, key = k.split("_", 1)
-			db.cursor().execute("CREATE TABLE IF NOT EXISTS documents_{addon} (name TEXT PRIMARY KEY, value TEXT)", ())
-			db.cursor().execute("INSERT INTO documents_{addon} VALUES (?, ?)", (key, v))
-			db.cursor().execute("DELETE FROM documents WHERE name = ?", k)
+def migrate_old_documents_to_namespaced_documents(db:str, addons:list):
+	# only keys starting with '<addon>_' of given addons are moved, everything else stays a core document
+	driver = StorageDriver(db)
+	moved = driver.migrate_addon_documents(addons)
+	driver.close()
+	print(f"[*] Moved {moved} documents")
 
 if __name__ == "__main__":
-	import sys
-	if len(sys.argv) < 2:
-		print("[!] No argument given")
+	if len(sys.argv) < 3:
+		print("[!] Usage: migrate-old-documents-to-namespaced-documents.py <session file> <addon> [addon ...]")
 		exit(-1)
-	migrate_old_documents_to_namespaced_documents(sys.argv[1])
-
+	migrate_old_documents_to_namespaced_documents(sys.argv[1], sys.argv[2:])
@@ -2,3 +2,5 @@ from .scaffold import ConfigObject
 from .treepuncher import Treepuncher
 from .addon import Addon
 from .notifier import Notifier, Provider
+from .supervisor import Supervisor
+from .fleet import Fleet
@@ -13,6 +13,8 @@ from dataclasses import MISSING, fields
 from setproctitle import setproctitle
 
 from .treepuncher import Treepuncher, MissingParameterError, Addon, Provider
+from .supervisor import Supervisor
+from .fleet import Fleet
 from .scaffold import ConfigObject
 from .helpers import configure_logging
 
@@ -58,7 +60,7 @@ def main():
 		formatter_class=argparse.RawDescriptionHelpFormatter,
 	)
 
-	parser.add_argument('name', help='name to use for this client session')
+	parser.add_argument('name', nargs='+', help='name to use for this client session, give many to run them all in this process')
 
 	parser.add_argument('--server', dest='server', default='', help='server to connect to')
 	parser.add_argument('--debug', dest='_debug', action='store_const', const=True, default=False, help="enable debug logs")
@@ -72,52 +74,68 @@ def main():
 	parser.add_argument('--print-token', dest='print_token', action='store_const', const=True, default=False, help="show legacy token before stopping")
 
 	parser.add_argument('--addons', dest='add', metavar="A", nargs='+', type=str, default=None, help='specify addons to enable, defaults to all')
+	parser.add_argument('--processes', dest='processes', type=int, default=0, help='how many processes to spread clients across, defaults to available cores')
+	parser.add_argument('--shared-storage', dest='shared_storage', default=None, help='one session file shared by all clients, by default each keeps its own data/<name>.session')
+	parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=0, help='serve prometheus metrics on this local port, fleet workers use the following ones')
 	# parser.add_argument('--addon-path', dest='path', default='', help='path for loading addons') # TODO make this possible
 
 	args = parser.parse_args()
 
-	configure_logging(args.name, level=logging.DEBUG if args._debug else logging.INFO)
-	setproctitle(f"treepuncher[{args.name}]")
-
-	kwargs = {}
-
-	if args.server:
-		kwargs["server"] = args.server
+	fleet = len(args.name) > 1
+	log_name = "fleet" if fleet else args.name[0]
+	configure_logging(log_name, level=logging.DEBUG if args._debug else logging.INFO)
+	setproctitle(f"treepuncher[{','.join(args.name)}]")
 
 	if not os.path.isdir('log'):
 		os.mkdir('log')
 	if not os.path.isdir('data'):
 		os.mkdir('data')
 
-	try:
+	metrics = { "metrics_port": args.metrics_port } if args.metrics_port else {}
+
+	def build_client(name:str, **kwargs) -> Treepuncher:
 		client = Treepuncher(
-			args.name,
+			name,
 			server=args.server or None,
 			online_mode=not args.offline,
 			legacy=args.mojang,
 			use_packet_whitelist=args.use_packet_whitelist,
 			code=args.code,
+			**kwargs
 		)
-	except MissingParameterError as e:
-		return logging.error(e.args[0])
 
-	enabled_addons = set(
-		a.lower() for a in (
-			args.add if args.add is not None else client.config.sections()
+		enabled_addons = set(
+			a.lower() for a in (
+				args.add if args.add is not None else client.config.sections()
+			)
 		)
-	)
 
-	# TODO ugly af! providers get installed first tho
+		# TODO ugly af! providers get installed first tho
 
-	for addon in addons:
-		if addon.__name__.lower() in enabled_addons and issubclass(addon, Provider):
-			logging.info("Installing '%s'", addon.__name__)
-			client.install(addon)
+		for addon in addons:
+			if addon.__name__.lower() in enabled_addons and issubclass(addon, Provider):
+				logging.info("Installing '%s'", addon.__name__)
+				client.install(addon)
 
-	for addon in addons:
-		if addon.__name__.lower() in enabled_addons and not issubclass(addon, Provider):
-			logging.info("Installing '%s'", addon.__name__)
-			client.install(addon)
+		for addon in addons:
+			if addon.__name__.lower() in enabled_addons and not issubclass(addon, Provider):
+				logging.info("Installing '%s'", addon.__name__)
+				client.install(addon)
+
+		return client
+
+	if fleet and args.processes != 1:  # shard clients across worker processes, each running a supervisor
+		Fleet(args.name, factory=build_client, processes=args.processes, storage=args.shared_storage, **metrics).run()
+		return
+
+	if fleet:  # all clients share this event loop, scheduler and storage
+		Supervisor(args.name, factory=build_client, storage=args.shared_storage, **metrics).run()
+		return
+
+	try:
+		client = build_client(args.name[0], **metrics)
+	except MissingParameterError as e:
+		return logging.error(e.args[0])
 
 	client.run()
 
@@ -6,8 +6,10 @@ from typing import TYPE_CHECKING, Dict, Any, Optional, Union, List, Callable, ge
 from dataclasses import dataclass, MISSING, fields
 
 from treepuncher.storage import AddonStorage
+from treepuncher.serialization import get_codec
 
 from .scaffold import ConfigObject
+from .traits import CallbackQueue, OverflowPolicy
 
 if TYPE_CHECKING:
 	from .treepuncher import Treepuncher
@@ -49,6 +51,7 @@ class Addon:
 	name: str
 	config: ConfigObject
 	storage: AddonStorage
+	queue: Optional[CallbackQueue]
 	logger: logging.Logger
 
 	_client: 'Treepuncher'
@@ -87,13 +90,34 @@ class Addon:
 		self.config = self.Options(**opts)
 		self.storage = self.init_storage()
 		self.logger = self._client.logger.getChild(self.name)
-		self.register()
+		self.queue = self.init_queue()
+		with self._client.queued_callbacks(self.queue):  # if the addon has a queue, its callbacks go through it
+			self.register()
 
 	def register(self):
 		pass
 
 	def init_storage(self) -> AddonStorage:
-		return self.client.storage.addon_storage(self.name)
+		cfg = self._client.config
+		return self.client.storage.addon_storage(
+			self.name,
+			# opt-in: cached values are shared, mutating one without put() changes what get() returns
+			cache_size=cfg.getint(self.name, "storage_cache_size", fallback=0),
+			codec=get_codec(cfg.get(self.name, "storage_codec", fallback="json")),
+		)
+
+	def init_queue(self) -> Optional[CallbackQueue]:
+		# opt-in: without a queue every callback runs concurrently, in its own task. A queue bounds them, but
+		# with one worker a callback waiting for a later event of this same addon would wait forever
+		cfg = self._client.config
+		if not any(cfg.has_option(self.name, k) for k in ("queue_size", "queue_workers", "queue_policy")):
+			return None
+		return CallbackQueue(
+			self.name,
+			maxsize=cfg.getint(self.name, "queue_size", fallback=1024),
+			concurrency=cfg.getint(self.name, "queue_workers", fallback=1),
+			policy=OverflowPolicy(cfg.get(self.name, "queue_policy", fallback="block").lower().replace('_', '-')),
+		)
 
 	async def initialize(self):
 		pass
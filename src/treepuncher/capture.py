@@ -0,0 +1,148 @@
+import io
+import asyncio
+import struct
+
+from time import perf_counter
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple, Type, Any
+
+from aiocraft.packet import Packet
+from aiocraft.proto.play import clientbound
+
+from .metrics import Histogram
+
+# capture files start with magic and protocol version, then one record per packet:
+#   offset (seconds since capture start), packet id, payload length, payload
+# payload is the packet as sent on the wire, after its id: replay decodes it like a connection would
+CAPTURE_MAGIC = b"TPCAP\x02"
+_HEADER = struct.Struct(">6sI")
+_RECORD = struct.Struct(">dHI")
+
+def _registry(proto:int) -> Dict[int, Type[Packet]]:
+	# packet ids change across versions, same lookup aiocraft does for incoming packets
+	if proto not in clientbound.REGISTRY:
+		raise ValueError(f"Unsupported protocol {proto}")
+	return clientbound.REGISTRY[proto]
+
+def _varint_size(value:int) -> int:
+	return max(1, (value.bit_length() + 6) // 7)
+
+class PacketRecorder:
+	"""tees packets received by a client to a capture file"""
+	path : str
+	proto : int
+	count : int
+
+	_file : BinaryIO
+	_start : float
+	_ids : Dict[Type[Packet], int]
+
+	def __init__(self, path:str, proto:int):
+		self.path = path
+		self.proto = proto
+		self.count = 0
+		self._ids = { cls: pid for pid, cls in _registry(proto).items() }
+		self._file = open(path, "wb")
+		self._file.write(_HEADER.pack(CAPTURE_MAGIC, proto))
+		self._start = perf_counter()
+
+	def record(self, packet:Packet):
+		pid = self._ids.get(type(packet))
+		if pid is None:
+			return
+		payload = packet.serialize().getvalue()[_varint_size(pid):]  # id is already in the record
+		self._file.write(_RECORD.pack(perf_counter() - self._start, pid, len(payload)))
+		self._file.write(payload)
+		self.count += 1
+
+	def close(self):
+		self._file.close()
+
+def read_capture(path:str, only:Optional[Set[str]] = None) -> Tuple[int, Iterator[Tuple[float, Packet]]]:
+	"""returns capture protocol version and an iterator of (offset, packet). Packets not in only (class names) aren't decoded"""
+	f = open(path, "rb")
+	magic, proto = _HEADER.unpack(f.read(_HEADER.size))
+	if magic != CAPTURE_MAGIC:
+		f.close()
+		raise ValueError(f"'{path}' is not a packet capture")
+	try:
+		registry = _registry(proto)
+	except ValueError:
+		f.close()
+		raise
+	if only is not None:
+		registry = { pid: cls for pid, cls in registry.items() if cls.__name__ in only }
+
+	def records() -> Iterator[Tuple[float, Packet]]:
+		with f:
+			while True:
+				head = f.read(_RECORD.size)
+				if len(head) < _RECORD.size:
+					return
+				offset, pid, payload_len = _RECORD.unpack(head)
+				cls = registry.get(pid)
+				if cls is None:
+					f.seek(payload_len, 1)
+					continue
+				yield offset, cls.deserialize(proto, io.BytesIO(f.read(payload_len)))
+
+	return proto, records()
+
+class ReplayDispatcher:
+	"""stands in for a connection, feeding a capture to Scaffold._play.
+	speed 1.0 keeps recorded timing, 0 replays as fast as possible"""
+	proto : int
+	connected : bool
+	speed : float
+	received : int
+	sent : List[Packet]
+	handling : Dict[str, Histogram]
+	elapsed : float
+
+	_packets : Iterator[Tuple[float, Packet]]
+
+	def __init__(self, path:str, speed:float = 0.0, only:Optional[Set[str]] = None):
+		self.proto, self._packets = read_capture(path, only)
+		self.connected = True
+		self.speed = speed
+		self.received = 0
+		self.sent = []
+		self.handling = {}
+		self.elapsed = 0.0
+
+	def promote(self, _:Any):
+		pass
+
+	def update_compression_threshold(self, _:int):
+		pass
+
+	async def write(self, packet:Packet, wait:bool = False):
+		self.sent.append(packet)
+
+	async def disconnect(self, block:bool = True):
+		self.connected = False
+
+	async def packets(self):
+		start = perf_counter()
+		for offset, packet in self._packets:
+			if not self.connected:
+				break
+			if self.speed > 0:
+				delay = offset / self.speed - (perf_counter() - start)
+				if delay > 0:
+					await asyncio.sleep(delay)
+			name = type(packet).__name__
+			handled = perf_counter()
+			yield packet  # resumes once _play is done with this packet and wants the next one
+			if name not in self.handling:
+				self.handling[name] = Histogram(name)
+			self.handling[name].observe(perf_counter() - handled)
+			self.received += 1
+		self.elapsed = perf_counter() - start
+		self.connected = False
+
+	def report(self) -> str:
+		rate = self.received / self.elapsed if self.elapsed else 0.0
+		lines = [ f"{self.received} packets in {self.elapsed:.2f}s ({rate:.0f} packets/s), {len(self.sent)} sent" ]
+		for h in sorted(self.handling.values(), key=lambda h: h.sum, reverse=True):
+			lines.append(f"  {h}, total {h.sum*1000:.1f}ms")
+		return '\n'.join(lines)
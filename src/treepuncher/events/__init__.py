@@ -1,6 +1,7 @@
-from .chat import ChatEvent
+from .chat import ChatEvent, ChatClassifier, ChatPattern, MessageType
+from .command import CommandEvent
 from .join_game import JoinGameEvent
 from .death import DeathEvent
 from .system import ConnectedEvent, DisconnectedEvent
-from .connection import PlayerJoinEvent, PlayerLeaveEvent
-from .block_update import BlockUpdateEvent
+from .connection import PlayerJoinEvent, PlayerLeaveEvent, PlayerBatchJoinEvent, PlayerBatchLeaveEvent
+from .block_update import BlockUpdateEvent, BlockBatchUpdateEvent
@@ -1,3 +1,6 @@
+from array import array
+from typing import Iterator
+
 from aiocraft.types import BlockPos
 
 from .base import BaseEvent
@@ -11,3 +14,24 @@ class BlockUpdateEvent(BaseEvent):
 	def __init__(self, location: BlockPos, state: int):
 		self.location = location
 		self.state = state
+
+class BlockBatchUpdateEvent(BaseEvent):
+	SENTINEL = object()
+
+	x      : array
+	y      : array
+	z      : array
+	states : array
+
+	def __init__(self, x: array, y: array, z: array, states: array):
+		self.x = x
+		self.y = y
+		self.z = z
+		self.states = states
+
+	def __len__(self) -> int:
+		return len(self.states)
+
+	def __iter__(self) -> Iterator[BlockUpdateEvent]:
+		for x, y, z, state in zip(self.x, self.y, self.z, self.states):
+			yield BlockUpdateEvent(BlockPos(x, y, z), state)
@@ -1,6 +1,6 @@
 import re
 
-from typing import Optional
+from typing import Optional, List, Tuple
 from enum import Enum
 
 from aiocraft.util.helpers import parse_chat
@@ -12,6 +12,14 @@ REMOVE_COLOR_FORMATS = re.compile(r"§[0-9a-z]")
 WHISPER_MATCHER = re.compile(r"(?:to (?P<touser>[A-Za-z0-9_]+)( |):|(?P<fromuser>[A-Za-z0-9_]+) whispers( |):|from (?P<from9b>[A-Za-z0-9_]+):) (?P<txt>.+)", flags=re.IGNORECASE)
 JOIN_LEAVE_MATCHER = re.compile(r"(?P<usr>[A-Za-z0-9_]+) (?P<action>joined|left)( the game|)$", flags=re.IGNORECASE)
 
+# all three matchers above in one pass. Alternatives are tried in the same order as before,
+# each scanning the whole text like search() would, so results don't change
+CHAT_CLASSIFIER = re.compile(
+	r"(?s:.*?)<(?P<usr>[A-Za-z0-9_]+)> (?P<msg>.+)"
+	r"|(?s:.*?)(?i:to (?P<touser>[A-Za-z0-9_]+)( |):|(?P<fromuser>[A-Za-z0-9_]+) whispers( |):|from (?P<from9b>[A-Za-z0-9_]+):) (?P<txt>.+)"
+	r"|(?s:.*?)(?P<jusr>[A-Za-z0-9_]+) (?P<action>(?i:joined|left))(?i:( the game|))$"
+)
+
 class MessageType(Enum):
 	CHAT = "chat"
 	WHISPER = "whisper"
@@ -21,40 +29,102 @@ class MessageType(Enum):
 	LEAVE = "leave"
 	SYSTEM = "system"
 
-class ChatEvent(BaseEvent):
-	text : str
+# type, user, target, message
+ChatFields = Tuple[MessageType, str, Optional[str], str]
+
+class ChatPattern:
+	"""server specific message format. Named groups 'user', 'target' and 'message' are used if present.
+	Regex is only tried on texts containing prefilter (lowercase), if given"""
+	regex : re.Pattern
 	type : MessageType
-	user : str
-	target : str
-	message : str
-
-	def __init__(self, text:str):
-		self.text = REMOVE_COLOR_FORMATS.sub("", parse_chat(text))
-		self.user = ""
-		self.target = ""
-		self.message= ""
-		self.type = MessageType.SYSTEM
-		self._parse()
-
-	def _parse(self):
-		match = CHAT_MESSAGE_MATCHER.search(self.text)
-		if match:
-			self.type = MessageType.CHAT
-			self.user = match["usr"]
-			self.message = match["msg"]
-			return
-
-		match = WHISPER_MATCHER.search(self.text)
-		if match:
-			self.type = MessageType.WHISPER
-			self.user = match["fromuser"] or match["from9b"]
-			self.target = match["touser"]
-			self.message = match["txt"]
-			return
-
-		match = JOIN_LEAVE_MATCHER.search(self.text)
-		if match:
-			self.type = MessageType.JOIN if match["action"] == "joined" else MessageType.LEAVE
-			self.message = "joined" if self.type == MessageType.JOIN else "left"
-			self.user = match["usr"]
-			return
+	prefilter : Optional[str]
+
+	def __init__(self, pattern:str, type:MessageType, prefilter:Optional[str] = None, flags:int = 0):
+		self.regex = re.compile(pattern, flags)
+		self.type = type
+		self.prefilter = prefilter.lower() if prefilter else None
+
+	def match(self, text:str, lowered:str) -> Optional[ChatFields]:
+		if self.prefilter is not None and self.prefilter not in lowered:
+			return None
+		match = self.regex.search(text)
+		if not match:
+			return None
+		groups = match.groupdict()
+		return self.type, groups.get("user") or "", groups.get("target") or "", groups.get("message") or ""
+
+class ChatClassifier:
+	patterns : List[ChatPattern]
+
+	def __init__(self):
+		self.patterns = []
+
+	def add(self, pattern:str, type:MessageType, prefilter:Optional[str] = None, flags:int = 0) -> ChatPattern:
+		p = ChatPattern(pattern, type, prefilter=prefilter, flags=flags)
+		self.patterns.append(p)
+		return p
+
+	def classify(self, text:str) -> ChatFields:
+		lowered = text.lower()
+		for p in self.patterns:  # server specific formats take precedence
+			fields = p.match(text, lowered)
+			if fields is not None:
+				return fields
+		# cheap substring checks first: most system messages can't match any matcher at all
+		if "> " not in text and "joined" not in lowered and "left" not in lowered and not (
+			":" in text and ("to " in lowered or "whispers" in lowered or "from " in lowered)
+		):
+			return MessageType.SYSTEM, "", "", ""
+		match = CHAT_CLASSIFIER.match(text)
+		if not match:
+			return MessageType.SYSTEM, "", "", ""
+		if match["usr"] is not None:
+			return MessageType.CHAT, match["usr"], "", match["msg"]
+		if match["txt"] is not None:
+			return MessageType.WHISPER, match["fromuser"] or match["from9b"], match["touser"], match["txt"]
+		if match["action"].lower() == "joined":
+			return MessageType.JOIN, match["jusr"], "", "joined"
+		return MessageType.LEAVE, match["jusr"], "", "left"
+
+DEFAULT_CLASSIFIER = ChatClassifier()
+
+class ChatEvent(BaseEvent):
+	"""text is only parsed and classified when its fields are first accessed"""
+	raw : str
+
+	_text : Optional[str]
+	_fields : Optional[ChatFields]
+	_classifier : ChatClassifier
+
+	def __init__(self, text:str, classifier:Optional[ChatClassifier] = None):
+		self.raw = text
+		self._text = None
+		self._fields = None
+		self._classifier = classifier or DEFAULT_CLASSIFIER
+
+	@property
+	def text(self) -> str:
+		if self._text is None:
+			self._text = REMOVE_COLOR_FORMATS.sub("", parse_chat(self.raw))
+		return self._text
+
+	def _parse(self) -> ChatFields:
+		if self._fields is None:
+			self._fields = self._classifier.classify(self.text)
+		return self._fields
+
+	@property
+	def type(self) -> MessageType:
+		return self._parse()[0]
+
+	@property
+	def user(self) -> str:
+		return self._parse()[1]
+
+	@property
+	def target(self) -> Optional[str]:
+		return self._parse()[2]
+
+	@property
+	def message(self) -> str:
+		return self._parse()[3]
@@ -0,0 +1,29 @@
+from typing import Any, Dict, List, TYPE_CHECKING
+if TYPE_CHECKING:
+	from ..game.commands import Command
+
+from .base import BaseEvent
+from .chat import ChatEvent, MessageType
+
+class CommandEvent(BaseEvent):
+	chat : ChatEvent
+	command : 'Command'
+	args : Dict[str, Any]
+	rest : List[str]
+
+	def __init__(self, chat:ChatEvent, command:'Command', args:Dict[str, Any], rest:List[str]):
+		self.chat = chat
+		self.command = command
+		self.args = args
+		self.rest = rest
+
+	@property
+	def user(self) -> str:
+		return self.chat.user
+
+	@property
+	def whisper(self) -> bool:
+		return self.chat.type is MessageType.WHISPER
+
+	def __getitem__(self, key:str) -> Any:
+		return self.args[key]
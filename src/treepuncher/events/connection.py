@@ -1,14 +1,46 @@
-from aiocraft.types import Player
+from typing import TYPE_CHECKING, Iterator, List
+
 from .base import BaseEvent
 
+if TYPE_CHECKING:
+	from ..game.tablist import TablistEntry
+
 class PlayerJoinEvent(BaseEvent):
-	player: Player
-	
-	def __init__(self, p:Player):
+	player: 'TablistEntry'
+
+	def __init__(self, p:'TablistEntry'):
 		self.player = p
 
 class PlayerLeaveEvent(BaseEvent):
-	player: Player
+	player: 'TablistEntry'
 
-	def __init__(self, p:Player):
+	def __init__(self, p:'TablistEntry'):
 		self.player = p
+
+class PlayerBatchJoinEvent(BaseEvent):
+	"""all players added by one tablist packet"""
+	players : List['TablistEntry']
+
+	def __init__(self, players:List['TablistEntry']):
+		self.players = players
+
+	def __len__(self) -> int:
+		return len(self.players)
+
+	def __iter__(self) -> Iterator[PlayerJoinEvent]:
+		for p in self.players:
+			yield PlayerJoinEvent(p)
+
+class PlayerBatchLeaveEvent(BaseEvent):
+	"""all players removed by one tablist packet"""
+	players : List['TablistEntry']
+
+	def __init__(self, players:List['TablistEntry']):
+		self.players = players
+
+	def __len__(self) -> int:
+		return len(self.players)
+
+	def __iter__(self) -> Iterator[PlayerLeaveEvent]:
+		for p in self.players:
+			yield PlayerLeaveEvent(p)
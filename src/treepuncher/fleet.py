@@ -0,0 +1,204 @@
+import os
+import sys
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from enum import Enum
+from time import time
+from typing import Dict, List, Optional, Any
+
+from setproctitle import setproctitle
+
+from .traits import Runnable
+from .supervisor import Supervisor, ClientFactory
+from .helpers import configure_logging
+
+EXIT_CONFIG = 78  # sysexits EX_CONFIG: all clients of a worker are misconfigured
+
+class WorkerState(Enum):
+	RUNNING = "running"
+	BACKOFF = "backoff"
+	STOPPING = "stopping"
+	FINISHED = "finished"
+
+def _run_shard(index:int, names:List[str], factory:ClientFactory, storage:Optional[str], log_level:int, kwargs:Dict[str, Any]):
+	os.setpgrp()  # terminal signals go to the fleet process only, which forwards them
+	for handler in logging.getLogger().handlers[:]:  # don't share log files with parent
+		logging.getLogger().removeHandler(handler)
+	configure_logging(f"fleet-{index}", level=log_level)
+	setproctitle(f"treepuncher[{','.join(names)}]")
+	asyncio.set_event_loop(asyncio.new_event_loop())  # parent loop is running, can't be reused
+	if kwargs.get("metrics_port"):  # one endpoint per worker, they can't all bind the same port
+		kwargs = dict(kwargs, metrics_port=int(kwargs["metrics_port"]) + index)
+	supervisor = Supervisor(names, factory=factory, storage=storage, **kwargs)
+	supervisor.run()
+	if supervisor._stop_task is None:  # nobody asked it to stop: its clients died, let the fleet restart it
+		sys.exit(EXIT_CONFIG if supervisor.misconfigured else 1)
+
+class Worker:
+	index : int
+	names : List[str]
+	process : Optional[multiprocessing.Process]
+	state : WorkerState
+	restarts : int
+	failures : int
+	started : float
+	retry_at : float
+	exitcode : Optional[int]
+
+	def __init__(self, index:int, names:List[str]):
+		self.index = index
+		self.names = names
+		self.process = None
+		self.state = WorkerState.BACKOFF
+		self.restarts = 0
+		self.failures = 0
+		self.started = 0.0
+		self.retry_at = 0.0
+		self.exitcode = None
+
+	@property
+	def pid(self) -> Optional[int]:
+		return self.process.pid if self.process is not None else None
+
+	def signal(self, signum:int):
+		if self.process is not None and self.process.is_alive():
+			os.kill(self.process.pid, signum)
+
+	def status(self) -> str:
+		uptime = f"{time() - self.started:.0f}s" if self.state is WorkerState.RUNNING else "-"
+		return f"worker {self.index} [{self.state.value}] pid={self.pid} up={uptime} " \
+			f"restarts={self.restarts} last_exit={self.exitcode} clients={','.join(self.names)}"
+
+class Fleet(Runnable):
+	"""shards clients across worker processes, each running a Supervisor.
+	Crashed workers are restarted with exponential backoff, signals are forwarded to workers"""
+	workers : List[Worker]
+	factory : ClientFactory
+	storage : Optional[str]
+	backoff : float
+	max_backoff : float
+	stable_after : float
+	status_interval : float
+	kill_timeout : float
+	logger : logging.Logger
+
+	_context : Any
+	_client_kwargs : Dict[str, Any]
+	_monitor : Optional[asyncio.Task]
+	_stopping : bool
+
+	def __init__(
+		self,
+		names:List[str],
+		factory:ClientFactory,
+		processes:int = 0,
+		storage:Optional[str] = None,
+		backoff:float = 1.0,
+		max_backoff:float = 300.0,
+		stable_after:float = 60.0,
+		status_interval:float = 300.0,
+		kill_timeout:float = 30.0,
+		**kwargs
+	):
+		super().__init__()
+		processes = min(processes or os.cpu_count() or 1, len(names))
+		self.workers = [ Worker(i, names[i::processes]) for i in range(processes) ]
+		self.factory = factory
+		self.storage = storage
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.stable_after = stable_after
+		self.status_interval = status_interval
+		self.kill_timeout = kill_timeout
+		self.logger = logging.getLogger("fleet")
+		self._context = multiprocessing.get_context("fork")  # factory is usually a closure, can't be pickled
+		self._client_kwargs = kwargs
+		self._monitor = None
+		self._stopping = False
+
+	def _spawn(self, worker:Worker):
+		worker.process = self._context.Process(
+			target=_run_shard,
+			args=(worker.index, worker.names, self.factory, self.storage, logging.getLogger().level, self._client_kwargs),
+			name=f"fleet-{worker.index}",
+		)
+		worker.process.start()
+		worker.state = WorkerState.RUNNING
+		worker.started = time()
+		self.logger.info("Started worker %d (pid %d) with %s", worker.index, worker.pid, ', '.join(worker.names))
+
+	def _reap(self, worker:Worker):
+		assert worker.process is not None
+		worker.exitcode = worker.process.exitcode
+		worker.process.close()
+		worker.process = None
+		if self._stopping or worker.exitcode == 0:  # clean exit: all its clients stopped
+			worker.state = WorkerState.FINISHED
+			self.logger.info("Worker %d finished", worker.index)
+			return
+		if worker.exitcode == EXIT_CONFIG:  # bad credentials or missing parameters, would fail the same way again
+			worker.state = WorkerState.FINISHED
+			self.logger.error("Worker %d stopped: its clients are misconfigured, not restarting it", worker.index)
+			return
+		if time() - worker.started >= self.stable_after:
+			worker.failures = 0  # was running fine for a while, don't punish it for old crashes
+		delay = min(self.backoff * (2 ** worker.failures), self.max_backoff)
+		worker.failures += 1
+		worker.restarts += 1
+		worker.state = WorkerState.BACKOFF
+		worker.retry_at = time() + delay
+		self.logger.warning("Worker %d crashed (exit code %s), restarting in %.0fs", worker.index, worker.exitcode, delay)
+
+	def report(self) -> str:
+		return '\n'.join(w.status() for w in self.workers)
+
+	async def _watch(self):
+		last_report = time()
+		while self._is_running:
+			for worker in self.workers:
+				if worker.process is not None and not worker.process.is_alive():
+					self._reap(worker)
+				if worker.state is WorkerState.BACKOFF and time() >= worker.retry_at and not self._stopping:
+					self._spawn(worker)
+			if not self._stopping and all(w.state is WorkerState.FINISHED for w in self.workers):
+				self.logger.info("All workers finished")
+				return await self.stop()
+			if self.status_interval > 0 and time() - last_report >= self.status_interval:
+				last_report = time()
+				self.logger.info("Fleet status:\n%s", self.report())
+			await asyncio.sleep(0.5)
+
+	async def start(self):
+		await super().start()
+		for worker in self.workers:
+			self._spawn(worker)
+		self._monitor = asyncio.get_event_loop().create_task(self._watch())
+
+	async def stop(self, force:bool = False):
+		self._stopping = True
+		deadline = time() + self.kill_timeout if force else None
+		for worker in self.workers:
+			if worker.state is WorkerState.BACKOFF:
+				worker.state = WorkerState.FINISHED
+			if worker.process is not None:  # workers run a Supervisor: SIGINT stops gracefully, SIGTERM forcefully
+				worker.state = WorkerState.STOPPING
+				worker.signal(signal.SIGTERM if force else signal.SIGINT)
+		while any(w.process is not None and w.process.is_alive() for w in self.workers):
+			if deadline is not None and time() >= deadline:
+				for worker in self.workers:
+					if worker.process is not None and worker.process.is_alive():
+						self.logger.error("Worker %d didn't stop in time, killing it", worker.index)
+						worker.signal(signal.SIGKILL)
+				deadline = None
+			await asyncio.sleep(0.1)
+		for worker in self.workers:
+			if worker.process is not None:
+				self._reap(worker)
+		if self._monitor is not None and self._monitor is not asyncio.current_task():
+			self._monitor.cancel()
+		self._monitor = None
+		self.logger.info("Fleet stopped:\n%s", self.report())
+		await super().stop()
@@ -1,23 +1,90 @@
 from aiocraft.proto.play.clientbound import PacketChat as PacketChatMessage
 from aiocraft.proto.play.serverbound import PacketChat
 
-from ..events.chat import ChatEvent
+import asyncio
+
+from typing import Sequence
+
+from ..events.chat import ChatEvent, ChatClassifier, MessageType
+from ..events.command import CommandEvent
 from ..scaffold import Scaffold
+from .commands import Command, CommandRouter, ArgSchema
+from .chat_queue import ChatQueue, ChatPriority
 
 class GameChat(Scaffold):
+	chat_classifier : ChatClassifier
+	commands : CommandRouter
+	chat_queue : ChatQueue
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
-		@self.on_packet(PacketChatMessage)
-		async def chat_event_callback(packet:PacketChatMessage):
-			self.run_callbacks(ChatEvent, ChatEvent(packet.message))
-
-	async def chat(self, message:str, whisper:str="", wait:bool=False):
-		if whisper:
-			message = f"/w {whisper} {message}"
-		await self.dispatcher.write(
-			PacketChat(message=message),
-			wait=wait
+		self.chat_classifier = ChatClassifier()  # addons can add server specific message formats
+		self.commands = CommandRouter()
+		self.chat_queue = ChatQueue(
+			self._send_chat,
+			lambda: getattr(self, "dispatcher", None) is not None and self.dispatcher.connected,
+			rate=self.cfg.getfloat("chat_rate", fallback=1.0),  # messages per second, 0 disables rate limiting
+			burst=self.cfg.getfloat("chat_burst", fallback=5.0),
+			max_length=self.cfg.getint("chat_max_length", fallback=256),
+			maxsize=self.cfg.getint("chat_queue_size", fallback=256),
+			logger=self.logger.getChild("chat"),
 		)
+		self.metrics.add(self.chat_queue.wait_time)
+		self.metrics.gauge("chat_queued", help="outbound chat messages waiting", fn=lambda: self.chat_queue.depth)
+
+		@self.on_packet(PacketChatMessage, inline=True)
+		def chat_event_callback(packet:PacketChatMessage):
+			if not self.commands and not self.trigger(ChatEvent):  # nobody listening, don't even build the event
+				return
+			event = ChatEvent(packet.message, self.chat_classifier)
+			self.run_callbacks(ChatEvent, event)
+			if self.commands:
+				self._route_command(event)
+
+	def on_command(
+		self,
+		name:str,
+		args:ArgSchema = (),
+		types:Sequence[MessageType] = (MessageType.CHAT, MessageType.WHISPER),
+		inline:bool = False,
+	):
+		"""handle a chat command, like on_command('!tp', (('x', int), ('z', int))). Handler gets a CommandEvent"""
+		def decorator(fun):
+			command = self.commands.add(Command(name, args=args, types=types))
+			return self.register(command.key, fun, inline=inline)
+		return decorator
+
+	def _route_command(self, event:ChatEvent):
+		found = self.commands.match(event.message)
+		if found is None:
+			return
+		command, tokens = found
+		if event.type not in command.types:
+			return
+		try:
+			args, rest = command.parse(tokens)
+		except ValueError as e:
+			self.logger.debug("Invalid command from %s : %s", event.user, str(e))
+			return
+		self.run_callbacks(command.key, CommandEvent(event, command, args, rest))
+
+	async def _send_chat(self, message:str):
+		await self.dispatcher.write(PacketChat(message=message))
+
+	async def chat(self, message:str, whisper:str="", wait:bool=False, priority:int=ChatPriority.NORMAL):
+		"""queue a chat message, long ones are split. With wait, return only once it has been sent"""
+		future = self.chat_queue.put(message, prefix=f"/w {whisper} " if whisper else "", priority=priority)
+		if not wait:
+			return
+		try:
+			await asyncio.shield(future)
+		except asyncio.CancelledError:
+			if not future.cancelled():
+				raise  # we are being cancelled ourselves
+			self.logger.warning("Chat queue is full, dropped message")
+
+	async def stop(self, force:bool=False):
+		await self.chat_queue.close()
+		await super().stop(force=force)
 
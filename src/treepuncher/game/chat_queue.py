@@ -0,0 +1,290 @@
+import asyncio
+import heapq
+import logging
+
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Iterator
+
+from ..metrics import Histogram
+
+class ChatPriority(IntEnum):
+	HIGH = 0
+	NORMAL = 1
+	LOW = 2
+
+def split_message(message:str, max_length:int, prefix:str = "") -> List[str]:
+	"""break message in chunks which fit in max_length once prefixed, on word boundaries when possible"""
+	room = max_length - len(prefix)
+	if room <= 0:
+		raise ValueError("Prefix leaves no room for the message")
+	chunks : List[str] = []
+	current = ""
+	for word in message.split(" "):
+		while len(word) > room:  # can't split on a space, cut the word
+			if current:
+				chunks.append(current)
+				current = ""
+			chunks.append(word[:room])
+			word = word[room:]
+		if not current:
+			current = word
+		elif len(current) + 1 + len(word) <= room:
+			current += " " + word
+		else:
+			chunks.append(current)
+			current = word
+	if current or not chunks:
+		chunks.append(current)
+	return [ prefix + c for c in chunks ]
+
+class TokenBucket:
+	rate : float
+	burst : float
+
+	_tokens : float
+	_last : float
+
+	def __init__(self, rate:float, burst:float):
+		self.rate = rate
+		self.burst = max(burst, 1.0)
+		self._tokens = self.burst
+		self._last = monotonic()
+
+	def _refill(self):
+		now = monotonic()
+		self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+		self._last = now
+
+	def delay(self) -> float:
+		"""seconds to wait before a token is available"""
+		if self.rate <= 0:
+			return 0.0
+		self._refill()
+		if self._tokens >= 1:
+			return 0.0
+		return (1 - self._tokens) / self.rate
+
+	def take(self):
+		if self.rate > 0:
+			self._refill()
+			self._tokens -= 1
+
+# priority, sequence, text, enqueue time, future, group (chunks of the same split message share it)
+_Entry = Tuple[int, int, str, float, asyncio.Future, Optional[int]]
+
+def _retrieve(future:asyncio.Future):
+	# most messages are sent without awaiting them: don't warn about errors nobody asked for, they're logged already
+	if not future.cancelled():
+		future.exception()
+
+def _combine(futures:List[asyncio.Future]) -> asyncio.Future:
+	"""future for a whole split message: sent once all chunks are, cancelled as soon as any is dropped"""
+	combined = asyncio.get_event_loop().create_future()
+	combined.add_done_callback(_retrieve)
+	remaining = [ len(futures) ]
+
+	def chunk_done(future:asyncio.Future):
+		if combined.done():
+			return
+		if future.cancelled():
+			combined.cancel()
+		elif future.exception() is not None:
+			combined.set_exception(future.exception())
+		else:
+			remaining[0] -= 1
+			if not remaining[0]:
+				combined.set_result(None)
+
+	def combined_done(_):
+		for future in futures:  # given up or failed: don't send what's left of it
+			future.cancel()
+
+	for future in futures:
+		future.add_done_callback(chunk_done)
+	combined.add_done_callback(combined_done)
+	return combined
+
+class ChatQueue:
+	"""outbound chat messages, sent in priority order without exceeding server spam limits"""
+	bucket : TokenBucket
+	max_length : int
+	maxsize : int
+	wait_time : Histogram
+
+	sent : int
+	dropped : int
+	deduplicated : int
+	split : int
+	peak : int
+
+	_send : Callable[[str], Awaitable[None]]
+	_ready : Callable[[], bool]
+	_heap : List[_Entry]
+	_pending : Dict[str, asyncio.Future]
+	_seq : Iterator[int]
+	_wakeup : Optional[asyncio.Event]
+	_sender : Optional[asyncio.Task]
+	logger : logging.Logger
+
+	def __init__(
+		self,
+		send:Callable[[str], Awaitable[None]],
+		ready:Callable[[], bool],
+		rate:float = 1.0,
+		burst:float = 5.0,
+		max_length:int = 256,
+		maxsize:int = 256,
+		logger:Optional[logging.Logger] = None,
+	):
+		self.bucket = TokenBucket(rate, burst)
+		self.max_length = max_length
+		self.maxsize = maxsize
+		self.wait_time = Histogram(
+			"chat_wait",
+			buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+			help="seconds outbound chat messages waited before being sent",
+		)
+		self.sent = 0
+		self.dropped = 0
+		self.deduplicated = 0
+		self.split = 0
+		self.peak = 0
+		self._send = send
+		self._ready = ready
+		self._heap = []
+		self._pending = {}
+		self._seq = count()
+		self._wakeup = None
+		self._sender = None
+		self.logger = logger or logging.getLogger("chat")
+
+	@property
+	def depth(self) -> int:
+		return len(self._heap)
+
+	def stats(self) -> Dict[str, float]:
+		return {
+			"depth": len(self._heap),
+			"peak": self.peak,
+			"sent": self.sent,
+			"dropped": self.dropped,
+			"deduplicated": self.deduplicated,
+			"split": self.split,
+			"wait_p99": self.wait_time.quantile(0.99),
+		}
+
+	def put(self, message:str, prefix:str = "", priority:int = ChatPriority.NORMAL) -> asyncio.Future:
+		"""enqueue a message, returned future resolves once it has been sent (or is cancelled, if dropped)"""
+		if self._sender is None:
+			self._wakeup = asyncio.Event()
+			self._sender = asyncio.get_event_loop().create_task(self._work())
+		chunks = split_message(message, self.max_length, prefix) if len(prefix) + len(message) > self.max_length else [ prefix + message ]
+		if len(chunks) == 1:
+			return self._put(chunks[0], priority)
+		self.split += 1
+		if not self._make_room(len(chunks), priority):  # never send only some parts of a message
+			return self._reject()
+		group = next(self._seq)
+		futures = []
+		for text in chunks:  # parts of a split message may repeat, only whole messages are deduplicated
+			future = asyncio.get_event_loop().create_future()
+			future.add_done_callback(_retrieve)
+			self._push(text, priority, future, group)
+			futures.append(future)
+		return _combine(futures)
+
+	def _put(self, text:str, priority:int) -> asyncio.Future:
+		existing = self._pending.get(text)
+		if existing is not None:  # same message already waiting to be sent, no point in spamming it twice
+			self.deduplicated += 1
+			self._promote(existing, priority)
+			return existing
+		if not self._make_room(1, priority):
+			return self._reject()
+		future = asyncio.get_event_loop().create_future()
+		future.add_done_callback(_retrieve)
+		self._push(text, priority, future, None)
+		self._pending[text] = future
+		return future
+
+	def _push(self, text:str, priority:int, future:asyncio.Future, group:Optional[int]):
+		heapq.heappush(self._heap, (priority, next(self._seq), text, monotonic(), future, group))
+		self.peak = max(self.peak, len(self._heap))
+		self._wakeup.set()
+
+	def _reject(self) -> asyncio.Future:
+		self.dropped += 1
+		future = asyncio.get_event_loop().create_future()
+		future.add_done_callback(_retrieve)
+		future.cancel()
+		return future
+
+	def _promote(self, future:asyncio.Future, priority:int):
+		for i, entry in enumerate(self._heap):
+			if entry[4] is future:
+				if priority < entry[0]:  # keeps its place among messages of the new priority queued after it
+					self._heap[i] = (priority,) + entry[1:]
+					heapq.heapify(self._heap)
+				return
+
+	def _make_room(self, size:int, priority:int) -> bool:
+		"""drop less important messages until size more fit, False if they can't"""
+		if self.maxsize <= 0 or len(self._heap) + size <= self.maxsize:
+			return True
+		if self.maxsize - len(self._heap) + sum(1 for e in self._heap if e[0] > priority) < size:
+			return False
+		while len(self._heap) + size > self.maxsize:
+			worst = max(self._heap)
+			if worst[5] is None:
+				victims = [ worst ]
+			else:  # the rest of a split message is useless without the dropped part
+				victims = [ e for e in self._heap if e[5] == worst[5] ]
+			self._heap = [ e for e in self._heap if e not in victims ]
+			heapq.heapify(self._heap)
+			for entry in victims:
+				if self._pending.get(entry[2]) is entry[4]:
+					self._pending.pop(entry[2])
+				entry[4].cancel()
+			self.dropped += 1
+		return True
+
+	async def _work(self):
+		while True:
+			while not self._heap:
+				self._wakeup.clear()
+				await self._wakeup.wait()
+			if not self._ready():
+				await asyncio.sleep(1)
+				continue
+			delay = self.bucket.delay()
+			if delay > 0:
+				await asyncio.sleep(delay)
+				continue  # something more important may have arrived meanwhile
+			_, _, text, queued, future, _ = heapq.heappop(self._heap)
+			if self._pending.get(text) is future:
+				self._pending.pop(text)
+			if future.cancelled():  # given up by whoever queued it
+				continue
+			self.bucket.take()
+			try:
+				await self._send(text)
+				self.sent += 1
+				self.wait_time.observe(monotonic() - queued)
+				if not future.done():
+					future.set_result(None)
+			except Exception as e:
+				self.logger.exception("Could not send chat message")
+				if not future.done():
+					future.set_exception(e)
+
+	async def close(self):
+		if self._sender is not None:
+			self._sender.cancel()
+			await asyncio.gather(self._sender, return_exceptions=True)
+			self._sender = None
+		for entry in self._heap:
+			entry[4].cancel()
+		self._heap.clear()
+		self._pending.clear()
@@ -0,0 +1,424 @@
+import sys
+
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional, Sequence, Iterable, AbstractSet, Any
+
+SECTION_VOLUME = 4096
+SECTIONS_PER_CHUNK = 16
+
+def read_varint(buf:bytes, off:int) -> Tuple[int, int]:
+	val = 0
+	for i in range(5):
+		b = buf[off + i]
+		val |= (b & 0x7F) << (7 * i)
+		if not b & 0x80:
+			return val, off + i + 1
+	raise ValueError("VarInt is too big")
+
+def unpack_longs(raw:bytes) -> array:
+	longs = array('Q', raw)
+	if sys.byteorder == 'little':
+		longs.byteswap()  # data arrays are sent as big endian longs
+	return longs
+
+def decode_padded(longs:array, bits:int) -> List[int]:
+	# 1.16+ : entries never span across two longs, unused high bits are padding
+	mask = (1 << bits) - 1
+	per_long = 64 // bits
+	out = [0] * (len(longs) * per_long)
+	for i in range(per_long):  # one pass per slot position rather than one per entry
+		shift = i * bits
+		out[i::per_long] = [ (l >> shift) & mask for l in longs ]
+	return out[:SECTION_VOLUME]
+
+def decode_compact(longs:array, bits:int) -> List[int]:
+	# pre 1.16 : entries are tightly packed and may span across two longs
+	mask = (1 << bits) - 1
+	out = [0] * SECTION_VOLUME
+	for i in range(SECTION_VOLUME):
+		bit = i * bits
+		idx, off = bit >> 6, bit & 63
+		val = longs[idx] >> off
+		if off + bits > 64:
+			val |= longs[idx + 1] << (64 - off)
+		out[i] = val & mask
+	return out
+
+def _axis_distance_sq(p:int, lo:int) -> int:
+	# squared distance from p to the closest point of [lo, lo+15]
+	if p < lo:
+		return (lo - p) ** 2
+	if p > lo + 15:
+		return (p - lo - 15) ** 2
+	return 0
+
+class ChunkSection:
+	"""16x16x16 blocks, kept as received until first accessed"""
+	__slots__ = ('count', 'bits', 'padded', 'palette', 'raw', 'blocks', 'index')
+
+	count : int
+	bits : int
+	padded : bool
+	palette : Optional[array]
+	raw : Optional[bytes]
+	blocks : Optional[array]
+	index : Optional[Dict[int, array]]
+
+	def __init__(self, count:int = 0, bits:int = 0, padded:bool = True, palette:Optional[array] = None, raw:Optional[bytes] = None):
+		self.count = count
+		self.bits = bits
+		self.padded = padded
+		self.palette = palette
+		self.raw = raw
+		self.blocks = None if raw is not None else array('H', bytes(2 * SECTION_VOLUME))
+		self.index = None
+
+	@property
+	def decoded(self) -> bool:
+		return self.blocks is not None
+
+	@property
+	def nbytes(self) -> int:
+		size = 0
+		if self.raw is not None:
+			size += len(self.raw)
+		if self.palette is not None:
+			size += len(self.palette) * self.palette.itemsize
+		if self.blocks is not None:
+			size += len(self.blocks) * self.blocks.itemsize
+		if self.index is not None:  # every block position is in exactly one index entry
+			size += 2 * SECTION_VOLUME
+		return size
+
+	def decode(self) -> array:
+		if self.blocks is None:
+			longs = unpack_longs(self.raw)
+			values = decode_padded(longs, self.bits) if self.padded else decode_compact(longs, self.bits)
+			if self.palette is not None:
+				palette = self.palette
+				values = [ palette[v] for v in values ]
+			self.blocks = array('H', values)
+			self.raw = None
+			self.palette = None
+		return self.blocks
+
+	def build_index(self) -> Dict[int, array]:
+		if self.index is None:
+			index : Dict[int, array] = {}
+			for i, state in enumerate(self.decode()):
+				if state in index:
+					index[state].append(i)
+				else:
+					index[state] = array('H', (i,))
+			self.index = index
+		return self.index
+
+	def may_contain(self, states:AbstractSet[int]) -> bool:
+		if self.index is not None:
+			return not states.isdisjoint(self.index.keys())
+		if self.blocks is None and self.palette is not None:  # can tell without decoding anything
+			return not states.isdisjoint(self.palette)
+		return True
+
+	def get(self, index:int) -> int:
+		return self.decode()[index]
+
+	def set(self, index:int, state:int):
+		blocks = self.decode()
+		prev = blocks[index]
+		if prev == state:
+			return
+		blocks[index] = state
+		if prev == 0:
+			self.count += 1
+		elif state == 0:
+			self.count -= 1
+		if self.index is not None:
+			positions = self.index[prev]
+			positions.remove(index)
+			if not positions:
+				del self.index[prev]
+			if state in self.index:
+				self.index[state].append(index)
+			else:
+				self.index[state] = array('H', (index,))
+
+class ChunkColumn:
+	x : int
+	z : int
+	sections : List[Optional[ChunkSection]]
+	block_entities : Any
+
+	def __init__(self, x:int, z:int, block_entities:Any = None):
+		self.x = x
+		self.z = z
+		self.sections = [ None ] * SECTIONS_PER_CHUNK
+		self.block_entities = block_entities
+
+	@property
+	def nbytes(self) -> int:
+		return sum(s.nbytes for s in self.sections if s is not None)
+
+	def read(self, data:bytes, bitmask:int, proto:int):
+		self.merge(read_sections(data, bitmask, proto))
+
+	def merge(self, sections:List[Optional[ChunkSection]]):
+		for y, section in enumerate(sections):
+			if section is not None:
+				self.sections[y] = section
+
+# light arrays sent after each section before 1.14, sky light only in dimensions which have it
+BLOCK_LIGHT_BYTES = 2048
+
+def _split_sections(data:bytes, bitmask:int, proto:int, light:int) -> Tuple[List[Optional[ChunkSection]], int]:
+	padded = proto >= 735
+	has_count = proto >= 477
+	direct_palette_length = proto < 393  # up to 1.12 an empty palette is still sent for global ids
+	sections : List[Optional[ChunkSection]] = [ None ] * SECTIONS_PER_CHUNK
+	off = 0
+	for y in range(SECTIONS_PER_CHUNK):
+		if not bitmask & (1 << y):
+			continue
+		count = 0
+		if has_count:
+			count = int.from_bytes(data[off:off+2], 'big', signed=True)
+			off += 2
+		bits = data[off]
+		off += 1
+		palette = None
+		if bits <= 8:
+			bits = max(bits, 4)
+			length, off = read_varint(data, off)
+			palette = array('H')
+			for _ in range(length):
+				state, off = read_varint(data, off)
+				palette.append(state)
+		elif direct_palette_length:
+			_, off = read_varint(data, off)
+		longs, off = read_varint(data, off)
+		if off + 8 * longs > len(data):
+			raise ValueError("Chunk section exceeds chunk data")
+		sections[y] = ChunkSection(count, bits, padded, palette, bytes(data[off:off + 8 * longs]))
+		off += 8 * longs + light
+	return sections, off
+
+def read_sections(data:bytes, bitmask:int, proto:int, decode:bool = False) -> List[Optional[ChunkSection]]:
+	"""split chunk data in sections, only touches its arguments so it can run in another thread or process"""
+	if proto >= 477:
+		sections, _ = _split_sections(data, bitmask, proto, 0)
+	else:
+		# sky light is only there in some dimensions: guess it from where sections end,
+		# either right at the end or before biomes (256 bytes, or 256 ints since 1.13)
+		biomes = 1024 if proto >= 393 else 256
+		sections = []
+		for light in (BLOCK_LIGHT_BYTES, 2 * BLOCK_LIGHT_BYTES):
+			try:
+				sections, end = _split_sections(data, bitmask, proto, light)
+			except (ValueError, IndexError):
+				continue
+			if end in (len(data), len(data) - biomes):
+				break
+		else:
+			raise ValueError(f"Malformed chunk data for protocol {proto}")
+	if decode:
+		for section in sections:
+			if section is not None:
+				section.decode()
+	return sections
+
+class ChunkStore:
+	"""world blocks storage, sections are decoded only when first accessed"""
+	max_bytes : int
+	evicted : int
+
+	_chunks : "OrderedDict[Tuple[int, int], ChunkColumn]"
+	_bytes : int
+
+	def __init__(self, max_bytes:int = 0):
+		self.max_bytes = max_bytes
+		self.evicted = 0
+		self._chunks = OrderedDict()  # least recently used first
+		self._bytes = 0
+
+	def __len__(self) -> int:
+		return len(self._chunks)
+
+	def __contains__(self, key:Tuple[int, int]) -> bool:
+		return key in self._chunks
+
+	def get(self, x:int, z:int, *legacy:int) -> Any:
+		"""chunk column at chunk coordinates x, z. With three block coordinates, block state like aiocraft World.get"""
+		if legacy:  # get(x, y, z) from aiocraft World, which failed loudly on unloaded chunks
+			state = self.get_block(x, z, legacy[0])
+			if state is None:
+				raise KeyError(f"Chunk {(x >> 4, legacy[0] >> 4)} not loaded")
+			return state
+		return self._chunks.get((x, z))
+
+	def __getitem__(self, pos:Tuple[int, int, int]) -> int:
+		return self.get(*pos)
+
+	def put(self, x:int, z:int, bitmask:int, data:bytes, full:bool, proto:int, block_entities:Any = None) -> ChunkColumn:
+		return self.put_sections(x, z, read_sections(data, bitmask, proto), full, block_entities)
+
+	def put_sections(self, x:int, z:int, sections:List[Optional[ChunkSection]], full:bool, block_entities:Any = None) -> ChunkColumn:
+		chunk = None if full else self._chunks.get((x, z))
+		if chunk is None:
+			self.remove(x, z)
+			chunk = ChunkColumn(x, z, block_entities)
+		before = chunk.nbytes
+		chunk.merge(sections)
+		self._chunks[(x, z)] = chunk
+		self._chunks.move_to_end((x, z))
+		self._bytes += chunk.nbytes - before
+		if self.max_bytes:
+			self.evict_lru(self.max_bytes)
+		return chunk
+
+	def remove(self, x:int, z:int) -> Optional[ChunkColumn]:
+		chunk = self._chunks.pop((x, z), None)
+		if chunk is not None:
+			self._bytes -= chunk.nbytes
+		return chunk
+
+	def clear(self):
+		self._chunks.clear()
+		self._bytes = 0
+
+	def evict_lru(self, max_bytes:int) -> int:
+		count = 0
+		while self._bytes > max_bytes and len(self._chunks) > 1:  # never evict the chunk just loaded
+			_, chunk = self._chunks.popitem(last=False)
+			self._bytes -= chunk.nbytes
+			count += 1
+		self.evicted += count
+		return count
+
+	def evict_outside(self, x:int, z:int, radius:int) -> int:
+		far = [ k for k in self._chunks if abs(k[0] - x) > radius or abs(k[1] - z) > radius ]
+		for k in far:
+			self.remove(*k)
+		self.evicted += len(far)
+		return len(far)
+
+	def _section(self, cx:int, sy:int, cz:int, create:bool = False) -> Tuple[Optional[ChunkColumn], Optional[ChunkSection]]:
+		chunk = self._chunks.get((cx, cz))
+		if chunk is None or not 0 <= sy < SECTIONS_PER_CHUNK:
+			return None, None
+		self._chunks.move_to_end((cx, cz))
+		section = chunk.sections[sy]
+		if section is None:
+			if create:
+				section = chunk.sections[sy] = ChunkSection()
+				self._bytes += section.nbytes
+		elif section.blocks is None:
+			before = section.nbytes
+			section.decode()
+			self._bytes += section.nbytes - before
+		return chunk, section
+
+	def get_block(self, x:int, y:int, z:int) -> Optional[int]:
+		chunk, section = self._section(x >> 4, y >> 4, z >> 4)
+		if chunk is None:
+			return None
+		if section is None:
+			return 0
+		return section.get(((y & 15) << 8) | ((z & 15) << 4) | (x & 15))
+
+	def put_block(self, x:int, y:int, z:int, state:int) -> bool:
+		chunk, section = self._section(x >> 4, y >> 4, z >> 4, create=state != 0)
+		if chunk is None:
+			return False
+		if section is not None:
+			section.set(((y & 15) << 8) | ((z & 15) << 4) | (x & 15), state)
+		return True
+
+	def put_blocks(self, xs:Sequence[int], ys:Sequence[int], zs:Sequence[int], states:Sequence[int]) -> int:
+		# group changes by section first, so that each section is looked up and decoded only once
+		changes : Dict[Tuple[int, int, int], List[Tuple[int, int]]] = {}
+		for x, y, z, state in zip(xs, ys, zs, states):
+			key = (x >> 4, y >> 4, z >> 4)
+			if key not in changes:
+				changes[key] = []
+			changes[key].append((((y & 15) << 8) | ((z & 15) << 4) | (x & 15), state))
+		count = 0
+		for (cx, sy, cz), section_changes in changes.items():
+			_, section = self._section(cx, sy, cz, create=True)
+			if section is None:
+				continue
+			if section.index is not None:  # keep block index up to date
+				for index, state in section_changes:
+					section.set(index, state)
+			else:
+				blocks = section.decode()
+				for index, state in section_changes:
+					blocks[index] = state
+				section.count = SECTION_VOLUME - blocks.count(0)
+			count += len(section_changes)
+		return count
+
+	def _index(self, section:ChunkSection) -> Dict[int, array]:
+		if section.index is None:
+			before = section.nbytes
+			section.build_index()
+			self._bytes += section.nbytes - before
+		return section.index
+
+	def _search(self, chunk:ChunkColumn, states:AbstractSet[int], x:int, y:int, z:int, max_sq:float) -> List[Tuple[int, Tuple[int, int, int]]]:
+		found = []
+		bx, bz = chunk.x << 4, chunk.z << 4
+		horizontal = _axis_distance_sq(x, bx) + _axis_distance_sq(z, bz)
+		for sy, section in enumerate(chunk.sections):
+			if section is None or not section.may_contain(states):
+				continue
+			by = sy << 4
+			if horizontal + _axis_distance_sq(y, by) > max_sq:
+				continue
+			index = self._index(section)
+			for state in states & index.keys():
+				for i in index[state]:
+					px, py, pz = bx + (i & 15), by + (i >> 8), bz + ((i >> 4) & 15)
+					dist = (px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2
+					if dist <= max_sq:
+						found.append((dist, (px, py, pz)))
+		return found
+
+	def find_blocks(self, states:Iterable[int], x:int, y:int, z:int, radius:float) -> List[Tuple[int, int, int]]:
+		"""positions of all loaded blocks with any of given states within radius, closest first"""
+		states = set(states)
+		max_sq = radius * radius
+		found = []
+		for chunk in self._chunks.values():
+			if _axis_distance_sq(x, chunk.x << 4) + _axis_distance_sq(z, chunk.z << 4) <= max_sq:
+				found += self._search(chunk, states, x, y, z, max_sq)
+		found.sort()
+		return [ pos for _, pos in found ]
+
+	def nearest_block(self, states:Iterable[int], x:int, y:int, z:int, radius:float = float('inf')) -> Optional[Tuple[int, int, int]]:
+		states = set(states)
+		best, best_sq = None, radius * radius
+		chunks = sorted(
+			(_axis_distance_sq(x, c.x << 4) + _axis_distance_sq(z, c.z << 4), key, c)
+			for key, c in self._chunks.items()
+		)
+		for dist, _, chunk in chunks:
+			if dist > best_sq:
+				break  # all following chunks are even further away
+			for found_sq, pos in self._search(chunk, states, x, y, z, best_sq):
+				if best is None or found_sq < best_sq:
+					best, best_sq = pos, found_sq
+		return best
+
+	def memory_usage(self) -> int:
+		return self._bytes
+
+	def stats(self) -> Dict[str, int]:
+		sections = [ s for c in self._chunks.values() for s in c.sections if s is not None ]
+		return {
+			"chunks": len(self._chunks),
+			"sections": len(sections),
+			"decoded": sum(1 for s in sections if s.decoded),
+			"bytes": self._bytes,
+			"evicted": self.evicted,
+		}
@@ -0,0 +1,80 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, FrozenSet
+
+from ..events.chat import MessageType
+
+# (name, converter) pairs, converter gets the raw token and may raise ValueError
+ArgSchema = Sequence[Tuple[str, Callable[[str], Any]]]
+
+class Command:
+	name : str
+	args : ArgSchema
+	types : FrozenSet[MessageType]
+	key : Tuple[str, str]
+
+	def __init__(self, name:str, args:ArgSchema = (), types:Sequence[MessageType] = (MessageType.CHAT, MessageType.WHISPER)):
+		self.name = name
+		self.args = tuple(args)
+		self.types = frozenset(types)
+		self.key = ("command", name)  # callbacks for this command are registered under this key
+
+	@property
+	def usage(self) -> str:
+		return ' '.join([self.name] + [ f"<{name}>" for name, _ in self.args ])
+
+	def parse(self, tokens:List[str]) -> Tuple[Dict[str, Any], List[str]]:
+		if len(tokens) < len(self.args):
+			raise ValueError(f"usage: {self.usage}")
+		values : Dict[str, Any] = {}
+		for (name, convert), token in zip(self.args, tokens):
+			try:
+				values[name] = convert(token)
+			except ValueError:
+				raise ValueError(f"invalid {name} '{token}', usage: {self.usage}")
+		return values, tokens[len(self.args):]
+
+class _Node:
+	__slots__ = ('children', 'command')
+
+	children : Dict[str, '_Node']
+	command : Optional[Command]
+
+	def __init__(self):
+		self.children = {}
+		self.command = None
+
+class CommandRouter:
+	"""matches chat messages against registered commands, one word of the message per trie level.
+	Commands can span many words ('!shop buy'), the longest registered match wins"""
+	_root : _Node
+	_count : int
+
+	def __init__(self):
+		self._root = _Node()
+		self._count = 0
+
+	def __len__(self) -> int:
+		return self._count
+
+	def add(self, command:Command) -> Command:
+		node = self._root
+		for word in command.name.lower().split():
+			if word not in node.children:
+				node.children[word] = _Node()
+			node = node.children[word]
+		if node.command is None:
+			self._count += 1
+			node.command = command
+		return node.command  # registering same command twice shares it, so both handlers run
+
+	def match(self, message:str) -> Optional[Tuple[Command, List[str]]]:
+		"""longest matching command and remaining words of message"""
+		tokens = message.split()
+		node = self._root
+		found : Optional[Tuple[Command, List[str]]] = None
+		for i, token in enumerate(tokens):
+			node = node.children.get(token.lower())  # type: ignore
+			if node is None:
+				break
+			if node.command is not None:
+				found = (node.command, tokens[i+1:])
+		return found
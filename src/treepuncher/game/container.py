@@ -51,12 +51,12 @@ class GameContainer(Scaffold):
 		super().__init__(*args, **kwargs)
 		self.window = None
 
-		@self.on(DisconnectedEvent)
-		async def disconnected_cb(_):
+		@self.on(DisconnectedEvent, inline=True)
+		def disconnected_cb(_):
 			self.window = None
 
-		@self.on_packet(PacketOpenWindow)
-		async def on_player_open_window(packet:PacketOpenWindow):
+		@self.on_packet(PacketOpenWindow, inline=True)
+		def on_player_open_window(packet:PacketOpenWindow):
 			assert isinstance(packet.inventoryType, str)
 			window_entity_id = packet.entityId if packet.inventoryType == "EntityHorse" and hasattr(packet, "entityId") else None
 			self.window = WindowContainer(
@@ -67,14 +67,14 @@ class GameContainer(Scaffold):
 				slot_count=packet.slotCount or 27
 			)
 
-		@self.on_packet(PacketSetSlot)
-		async def on_set_slot(packet:PacketSetSlot):
+		@self.on_packet(PacketSetSlot, inline=True)
+		def on_set_slot(packet:PacketSetSlot):
 			if packet.windowId == 0:
 				self.window = None
 			elif self.window and packet.windowId == self.window.id:
 				self.window.inventory[packet.slot] = packet.item
 
-		@self.on_packet(PacketTransaction)
+		@self.on_packet(PacketTransaction, inline=True)
 		async def on_transaction_denied(packet:PacketTransaction):
 			if self.window and packet.windowId == self.window.id:
 				if not packet.accepted:  # apologize to server automatically
@@ -29,11 +29,11 @@ class GameInventory(Scaffold):
 		self.slot = 0
 		self.inventory = [ Item() for _ in range(46) ]
 
-		@self.on_packet(PacketSetSlot)
-		async def on_set_slot(packet:PacketSetSlot):
+		@self.on_packet(PacketSetSlot, inline=True)
+		def on_set_slot(packet:PacketSetSlot):
 			if packet.windowId == 0: # player inventory
 				self.inventory[packet.slot] = packet.item
 
-		@self.on_packet(PacketHeldItemChange)
-		async def on_held_item_change(packet:PacketHeldItemChange):
+		@self.on_packet(PacketHeldItemChange, inline=True)
+		def on_held_item_change(packet:PacketHeldItemChange):
 			self.slot = packet.slot
@@ -50,12 +50,12 @@ class GameState(Scaffold):
 		self.lvl = 0
 		self.total_xp = 0
 
-		@self.on(DisconnectedEvent)
-		async def disconnected_cb(_):
+		@self.on(DisconnectedEvent, inline=True)
+		def disconnected_cb(_):
 			self.in_game = False
 
-		@self.on_packet(PacketRespawn)
-		async def on_player_respawning(packet:PacketRespawn):
+		@self.on_packet(PacketRespawn, inline=True)
+		def on_player_respawning(packet:PacketRespawn):
 			self.gamemode = Gamemode(packet.gamemode)
 			if isinstance(packet.dimension, dict):
 				self.logger.info("Received dimension data: %s", json.dumps(packet.dimension, indent=2))
@@ -75,12 +75,12 @@ class GameState(Scaffold):
 				self.gamemode.name
 			)
 
-		@self.on_packet(PacketDifficulty)
-		async def on_set_difficulty(packet:PacketDifficulty):
+		@self.on_packet(PacketDifficulty, inline=True)
+		def on_set_difficulty(packet:PacketDifficulty):
 			self.difficulty = Difficulty(packet.difficulty)
 			self.logger.info("Difficulty set to %s", self.difficulty.name)
 
-		@self.on_packet(PacketLogin)
+		@self.on_packet(PacketLogin, inline=True)
 		async def player_joining_cb(packet:PacketLogin):
 			self.entity_id = packet.entityId
 			self.gamemode = Gamemode(packet.gameMode)
@@ -116,7 +116,7 @@ class GameState(Scaffold):
 			)
 			await self.dispatcher.write(PacketClientCommand(actionId=0))
 
-		@self.on_packet(PacketUpdateHealth)
+		@self.on_packet(PacketUpdateHealth, inline=True)  # not coalesced: deaths must be handled before respawns
 		async def player_hp_cb(packet:PacketUpdateHealth):
 			died = packet.health != self.hp and packet.health <= 0
 			if self.hp != packet.health:
@@ -134,16 +134,16 @@ class GameState(Scaffold):
 					PacketClientCommand(actionId=0) # respawn
 				)
 
-		@self.on_packet(PacketExperience)
-		async def player_xp_cb(packet:PacketExperience):
+		@self.on_packet(PacketExperience, inline=True, coalesce=lambda _: "xp")  # only the newest matters
+		def player_xp_cb(packet:PacketExperience):
 			if packet.level != self.lvl:
 				self.logger.info("Level up : %d", packet.level)
 			self.xp = packet.experienceBar
 			self.lvl = packet.level
 			self.total_xp = packet.totalExperience
 
-		@self.on_packet(PacketAbilities)
-		async def player_abilities_cb(packet:PacketAbilities):
+		@self.on_packet(PacketAbilities, inline=True)
+		def player_abilities_cb(packet:PacketAbilities):
 			self.flags = packet.flags
 			self.flyingSpeed = packet.flyingSpeed
 			self.walkingSpeed = packet.walkingSpeed
@@ -2,12 +2,13 @@ import uuid
 import datetime
 
 from enum import Enum
+from typing import Any, Dict, List, Optional
 
 from aiocraft.types import Player
 from aiocraft.proto import PacketPlayerInfo
 
 from ..scaffold import Scaffold
-from ..events import ConnectedEvent, PlayerJoinEvent, PlayerLeaveEvent
+from ..events import ConnectedEvent, PlayerJoinEvent, PlayerLeaveEvent, PlayerBatchJoinEvent, PlayerBatchLeaveEvent
 
 class ActionType(Enum): # TODO move this in aiocraft
 	ADD_PLAYER = 0
@@ -16,37 +17,98 @@ class ActionType(Enum): # TODO move this in aiocraft
 	UPDATE_DISPLAY_NAME = 3
 	REMOVE_PLAYER = 4
 
+class TablistEntry:
+	"""tablist player, same fields as aiocraft Player but without a __dict__ per instance"""
+	__slots__ = ('UUID', 'name', 'properties', 'gamemode', 'ping', 'displayName', 'joinTime')
+
+	UUID : uuid.UUID
+	name : str
+	properties : Any
+	gamemode : int
+	ping : int
+	displayName : Optional[str]
+	joinTime : datetime.datetime
+
+	def __init__(self, record:Dict[str, Any], joinTime:datetime.datetime):
+		self.UUID = record['UUID']
+		self.name = record.get('name', '')
+		self.properties = record.get('properties')
+		self.gamemode = record.get('gamemode', 0)
+		self.ping = record.get('ping', 0)
+		self.displayName = record.get('displayName')
+		self.joinTime = joinTime
+
+	def __repr__(self) -> str:
+		return f"TablistEntry({self.name}, {self.UUID})"
+
+	def serialize(self) -> Dict[str, Any]:
+		return { k: getattr(self, k) for k in self.__slots__ }
+
+	def player(self) -> Player:
+		return Player.deserialize(self.serialize())
+
 class GameTablist(Scaffold):
-	tablist : dict[uuid.UUID, Player]
+	tablist : Dict[uuid.UUID, TablistEntry]
+
+	_tablist_names : Dict[str, TablistEntry]
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
 		self.tablist = {}
+		self._tablist_names = {}
 
-		@self.on(ConnectedEvent)
-		async def connected_cb(_):
+		@self.on(ConnectedEvent, inline=True)
+		def connected_cb(_):
 			self.tablist.clear()
+			self._tablist_names.clear()
 
-		@self.on_packet(PacketPlayerInfo)
-		async def tablist_update(packet:PacketPlayerInfo):
-			for record in packet.data:
-				uid = record['UUID']
-				if packet.action != ActionType.ADD_PLAYER.value and uid not in self.tablist:
-					continue # TODO this happens kinda often but doesn't seem to be an issue?
-				if packet.action == ActionType.ADD_PLAYER.value:
-					record['joinTime'] = datetime.datetime.now()
-					self.tablist[uid] = Player.deserialize(record) # TODO have it be a Player type inside packet
-					self.run_callbacks(PlayerJoinEvent, PlayerJoinEvent(Player.deserialize(record)))
-				elif packet.action == ActionType.UPDATE_GAMEMODE.value:
-					self.tablist[uid].gamemode = record['gamemode']
-				elif packet.action == ActionType.UPDATE_LATENCY.value:
-					self.tablist[uid].ping = record['ping']
-				elif packet.action == ActionType.UPDATE_DISPLAY_NAME.value:
-					self.tablist[uid].displayName = record['displayName']
-				elif packet.action == ActionType.REMOVE_PLAYER.value:
-					self.tablist.pop(uid, None)
-					self.run_callbacks(PlayerLeaveEvent, PlayerLeaveEvent(Player.deserialize(record)))
-
-
+		@self.on_packet(PacketPlayerInfo, inline=True)
+		def tablist_update(packet:PacketPlayerInfo):
+			if packet.action == ActionType.ADD_PLAYER.value:
+				now = datetime.datetime.now()
+				joined : List[TablistEntry] = []
+				for record in packet.data:
+					entry = TablistEntry(record, now)
+					previous = self.tablist.get(entry.UUID)
+					if previous is not None and self._tablist_names.get(previous.name.lower()) is previous:
+						del self._tablist_names[previous.name.lower()]
+					self.tablist[entry.UUID] = entry
+					self._tablist_names[entry.name.lower()] = entry
+					joined.append(entry)
+				if joined:
+					batch_join = PlayerBatchJoinEvent(joined)
+					self.run_callbacks(PlayerBatchJoinEvent, batch_join)
+					if self.trigger(PlayerJoinEvent):  # only build single player events if someone listens to them
+						for join in batch_join:
+							self.run_callbacks(PlayerJoinEvent, join)
+			elif packet.action == ActionType.REMOVE_PLAYER.value:
+				left : List[TablistEntry] = []
+				for record in packet.data:
+					entry = self.tablist.pop(record['UUID'], None)
+					if entry is None:
+						continue
+					if self._tablist_names.get(entry.name.lower()) is entry:
+						del self._tablist_names[entry.name.lower()]
+					left.append(entry)
+				if left:
+					batch_leave = PlayerBatchLeaveEvent(left)
+					self.run_callbacks(PlayerBatchLeaveEvent, batch_leave)
+					if self.trigger(PlayerLeaveEvent):
+						for leave in batch_leave:
+							self.run_callbacks(PlayerLeaveEvent, leave)
+			else:
+				for record in packet.data:
+					entry = self.tablist.get(record['UUID'])
+					if entry is None:
+						continue # TODO this happens kinda often but doesn't seem to be an issue?
+					if packet.action == ActionType.UPDATE_GAMEMODE.value:
+						entry.gamemode = record['gamemode']
+					elif packet.action == ActionType.UPDATE_LATENCY.value:
+						entry.ping = record['ping']
+					elif packet.action == ActionType.UPDATE_DISPLAY_NAME.value:
+						entry.displayName = record['displayName']
 
+	def find_player(self, name:str) -> Optional[TablistEntry]:
+		"""tablist entry by player name, case insensitive"""
+		return self._tablist_names.get(name.lower())
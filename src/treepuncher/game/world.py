@@ -1,79 +1,145 @@
-import json
+import asyncio
+
 from time import time
+from array import array
+from collections import deque
+from functools import partial
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterable, List, Optional, Deque, Tuple, Dict, Callable, Any
 
 from aiocraft.types import BlockPos
 from aiocraft.proto import (
 	PacketMapChunk, PacketBlockChange, PacketMultiBlockChange, PacketSetPassengers, PacketEntityTeleport,
-	PacketSteerVehicle, PacketRelEntityMove, PacketTeleportConfirm
+	PacketSteerVehicle, PacketRelEntityMove, PacketTeleportConfirm, PacketUnloadChunk, PacketRespawn
 )
 from aiocraft.proto.play.clientbound import PacketPosition
 from aiocraft.primitives import twos_comp
 
-from aiocraft import Chunk, World  # TODO these imports will hopefully change!
-
 from ..scaffold import Scaffold
-from ..events import BlockUpdateEvent
+from ..events import BlockUpdateEvent, BlockBatchUpdateEvent, ConnectedEvent
+from .chunks import ChunkStore, read_sections
+
+_DECODERS : Dict[Tuple[bool, int], Executor] = {}
+
+def decoder_pool(workers:int, processes:bool = False) -> Executor:
+	# shared by all clients in this process, so a fleet doesn't spawn a pool per client
+	key = (processes, workers)
+	if key not in _DECODERS:
+		_DECODERS[key] = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers, thread_name_prefix="chunk-decoder")
+	return _DECODERS[key]
 
 class GameWorld(Scaffold):
 	position : BlockPos
 	vehicle_id : int | None
-	world : World
+	world : ChunkStore
 
 	_last_steer_vehicle : float
+	_view_distance : int
+	_view_center : tuple[int, int]
+	_per_block_events : bool
+	_decoder : Optional[Executor]
+	_decode_eager : bool
+	_world_ops : Deque[Tuple[Optional[asyncio.Future], Callable[[Any], None]]]
+
+	def find_blocks(self, states:int | Iterable[int], radius:float = 64) -> List[BlockPos]:
+		if isinstance(states, int):
+			states = (states,)
+		found = self.world.find_blocks(states, self.position.i_x, self.position.i_y, self.position.i_z, radius)
+		return [ BlockPos(x, y, z) for x, y, z in found ]
+
+	def nearest_block(self, states:int | Iterable[int], radius:float = float('inf')) -> Optional[BlockPos]:
+		if isinstance(states, int):
+			states = (states,)
+		found = self.world.nearest_block(states, self.position.i_x, self.position.i_y, self.position.i_z, radius)
+		return BlockPos(*found) if found else None
+
+	def _world_op(self, apply:Callable[[Any], None], job:Optional[Callable[[], Any]] = None):
+		"""apply world changes in packet order, even when some need to be decoded in the background first"""
+		if job is not None and self._decoder is not None:
+			future = asyncio.get_event_loop().run_in_executor(self._decoder, job)
+			future.add_done_callback(lambda _: self._drain_world_ops())
+			self._world_ops.append((future, apply))
+		elif self._world_ops:  # can't overtake chunks still being decoded
+			self._world_ops.append((None, lambda _: apply(job() if job is not None else None)))
+		else:
+			apply(job() if job is not None else None)
+
+	def _drain_world_ops(self):
+		while self._world_ops:
+			future, apply = self._world_ops[0]
+			if future is not None and not future.done():
+				return
+			self._world_ops.popleft()
+			try:
+				apply(future.result() if future is not None else None)
+			except Exception:
+				self.logger.exception("Exception applying world update")
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
-		self.world = World()
+		self.world = ChunkStore(max_bytes=self.cfg.getint("world_memory_budget", fallback=0))
+		self.metrics.gauge("world_bytes", help="memory used by stored chunk sections", fn=self.world.memory_usage)
 		self.position = BlockPos(0, 0, 0)
 		self.vehicle_id = None
 		self._last_steer_vehicle = time()
+		self._view_distance = self.cfg.getint("world_view_distance", fallback=0)
+		self._view_center = (0, 0)
+		self._per_block_events = self.cfg.getboolean("multi_block_update_events", fallback=False)
+		decode_workers = self.cfg.getint("world_decode_workers", fallback=0)
+		self._decoder = decoder_pool(
+			decode_workers, processes=self.cfg.getboolean("world_decode_processes", fallback=False)
+		) if decode_workers > 0 else None
+		self._decode_eager = self.cfg.getboolean("world_decode_eager", fallback=decode_workers > 0)
+		self._world_ops = deque()
 
-		@self.on_packet(PacketSetPassengers)
-		async def player_enters_vehicle_cb(packet:PacketSetPassengers):
-			if self.vehicle_id is None: # might get mounted on a vehicle
-				for entity_id in packet.passengers:
-					if entity_id == self.entity_id:
-						self.vehicle_id = packet.entityId
-			else: # might get dismounted from vehicle
-				if packet.entityId == self.vehicle_id:
-					if self.entity_id not in packet.passengers:
-						self.vehicle_id = None
-
-		@self.on_packet(PacketEntityTeleport)
-		async def entity_rubberband_cb(packet:PacketEntityTeleport):
-			if self.vehicle_id is None:
-				return
-			if self.vehicle_id != packet.entityId:
-				return
-			self.position = BlockPos(packet.x, packet.y, packet.z)
-			self.logger.info(
-				"Position synchronized : (x:%.0f,y:%.0f,z:%.0f) (vehicle)",
-				self.position.x, self.position.y, self.position.z
-			)
+		# entity movements are among the most frequent packets: when not needed, don't even have them decoded
+		if self.cfg.getboolean("track_vehicles", fallback=True):
+			@self.on_packet(PacketSetPassengers, inline=True)
+			def player_enters_vehicle_cb(packet:PacketSetPassengers):
+				if self.vehicle_id is None: # might get mounted on a vehicle
+					for entity_id in packet.passengers:
+						if entity_id == self.entity_id:
+							self.vehicle_id = packet.entityId
+				else: # might get dismounted from vehicle
+					if packet.entityId == self.vehicle_id:
+						if self.entity_id not in packet.passengers:
+							self.vehicle_id = None
 
-		@self.on_packet(PacketRelEntityMove)
-		async def entity_relative_move_cb(packet:PacketRelEntityMove):
-			if self.vehicle_id is None:
-				return
-			if self.vehicle_id != packet.entityId:
-				return
-			self.position = BlockPos(
-				self.position.x + packet.dX,
-				self.position.y + packet.dY,
-				self.position.z + packet.dZ
-			)
-			self.logger.debug(
-				"Position synchronized : (x:%.0f,y:%.0f,z:%.0f) (relMove vehicle)",
-				self.position.x, self.position.y, self.position.z
-			)
-			if time() - self._last_steer_vehicle >= 5:
-				self._last_steer_vehicle = time()
-				await self.dispatcher.write(
-					PacketSteerVehicle(forward=0, sideways=0, jump=0)
+			@self.on_packet(PacketEntityTeleport, inline=True)  # not coalesced: must stay ordered with relative moves
+			def entity_rubberband_cb(packet:PacketEntityTeleport):
+				if self.vehicle_id is None:
+					return
+				if self.vehicle_id != packet.entityId:
+					return
+				self.position = BlockPos(packet.x, packet.y, packet.z)
+				self.logger.info(
+					"Position synchronized : (x:%.0f,y:%.0f,z:%.0f) (vehicle)",
+					self.position.x, self.position.y, self.position.z
 				)
 
-		@self.on_packet(PacketPosition)
+			@self.on_packet(PacketRelEntityMove, inline=True)
+			async def entity_relative_move_cb(packet:PacketRelEntityMove):
+				if self.vehicle_id is None:
+					return
+				if self.vehicle_id != packet.entityId:
+					return
+				self.position = BlockPos(
+					self.position.x + packet.dX,
+					self.position.y + packet.dY,
+					self.position.z + packet.dZ
+				)
+				self.logger.debug(
+					"Position synchronized : (x:%.0f,y:%.0f,z:%.0f) (relMove vehicle)",
+					self.position.x, self.position.y, self.position.z
+				)
+				if time() - self._last_steer_vehicle >= 5:
+					self._last_steer_vehicle = time()
+					await self.dispatcher.write(
+						PacketSteerVehicle(forward=0, sideways=0, jump=0)
+					)
+
+		@self.on_packet(PacketPosition, priority=True)  # server waits for teleport confirmation
 		async def player_rubberband_cb(packet:PacketPosition):
 			self.position = BlockPos(packet.x, packet.y, packet.z)
 			self.logger.info(
@@ -88,41 +154,74 @@ class GameWorld(Scaffold):
 		if not self.cfg.getboolean("process_world", fallback=False):
 			return
 
-		@self.on_packet(PacketMapChunk)
-		async def map_chunk_cb(packet:PacketMapChunk):
+		@self.on(ConnectedEvent, inline=True)
+		def world_reset_cb(_):
+			self._world_op(lambda _: self.world.clear())
+
+		@self.on_packet(PacketRespawn, inline=True)
+		def world_respawn_cb(_):
+			self._world_op(lambda _: self.world.clear())  # server will send all chunks again
+
+		@self.on_packet(PacketUnloadChunk, inline=True)
+		def unload_chunk_cb(packet:PacketUnloadChunk):
+			self._world_op(lambda _: self.world.remove(packet.chunkX, packet.chunkZ))
+
+		def store_chunk(packet:PacketMapChunk, sections):
+			self.world.put_sections(packet.x, packet.z, sections, packet.groundUp, packet.blockEntities)
+			if self._view_distance:
+				center = (self.position.i_x >> 4, self.position.i_z >> 4)
+				if center != self._view_center:  # only scan again after moving to another chunk
+					self._view_center = center
+					evicted = self.world.evict_outside(center[0], center[1], self._view_distance)
+					if evicted:
+						self.logger.debug("Evicted %d chunks outside view distance", evicted)
+
+		@self.on_packet(PacketMapChunk, inline=True)
+		def map_chunk_cb(packet:PacketMapChunk):
 			assert isinstance(packet.bitMap, int)
-			c = Chunk(packet.x, packet.z, packet.bitMap, packet.groundUp, json.dumps(packet.blockEntities))  # TODO a solution which is not jank!
-			c.read(packet.chunkData)
-			self.world.put(c, packet.x, packet.z, not packet.groundUp)
-
-		@self.on_packet(PacketBlockChange)
-		async def block_change_cb(packet:PacketBlockChange):
-			self.world.put_block(packet.location[0], packet.location[1], packet.location[2], packet.type)
-			pos = BlockPos(packet.location[0], packet.location[1], packet.location[2])
-			self.run_callbacks(BlockUpdateEvent, BlockUpdateEvent(pos, packet.type))
-
-		@self.on_packet(PacketMultiBlockChange)
-		async def multi_block_change_cb(packet:PacketMultiBlockChange):
+			if self.dispatcher.proto < 107:  # before 1.9 chunks weren't paletted
+				self.logger.error("Cannot process MapChunk for protocol %d", self.dispatcher.proto)
+				return
+			# sections are split (and decoded, if eager) in decoder pool when configured, then stored in order
+			self._world_op(
+				partial(store_chunk, packet),
+				partial(read_sections, packet.chunkData, packet.bitMap, self.dispatcher.proto, self._decode_eager),
+			)
+
+		def store_block(x:int, y:int, z:int, state:int):
+			self.world.put_block(x, y, z, state)
+			self.run_callbacks(BlockUpdateEvent, BlockUpdateEvent(BlockPos(x, y, z), state))
+
+		@self.on_packet(PacketBlockChange, inline=True)
+		def block_change_cb(packet:PacketBlockChange):
+			self._world_op(lambda _: store_block(packet.location[0], packet.location[1], packet.location[2], packet.type))
+
+		def store_blocks(batch:BlockBatchUpdateEvent):
+			self.world.put_blocks(batch.x, batch.y, batch.z, batch.states)
+			self.run_callbacks(BlockBatchUpdateEvent, batch)
+			if self._per_block_events:
+				for event in batch:
+					self.run_callbacks(BlockUpdateEvent, event)
+
+		@self.on_packet(PacketMultiBlockChange, inline=True)
+		def multi_block_change_cb(packet:PacketMultiBlockChange):
+			records = packet.records
 			if self.dispatcher.proto < 751:
-				chunk_x_off = packet.chunkX * 16
-				chunk_z_off = packet.chunkZ * 16
-				for entry in packet.records:
-					x_off = (entry['horizontalPos'] >> 4 ) & 15
-					z_off = entry['horizontalPos'] & 15
-					pos = BlockPos(x_off + chunk_x_off, entry['y'], z_off + chunk_z_off)
-					self.world.put_block(pos.i_x, pos.i_y, pos.i_z, entry['blockId'])
-					self.run_callbacks(BlockUpdateEvent, BlockUpdateEvent(pos, entry['blockId']))
+				cx, cz = packet.chunkX * 16, packet.chunkZ * 16
+				xs = array('i', [ cx + ((r['horizontalPos'] >> 4) & 15) for r in records ])
+				ys = array('i', [ r['y'] for r in records ])
+				zs = array('i', [ cz + (r['horizontalPos'] & 15) for r in records ])
+				states = array('i', [ r['blockId'] for r in records ])
 			elif self.dispatcher.proto < 760:
-				x = twos_comp((packet.chunkCoordinates >> 42) & 0x3FFFFF, 22)
-				z = twos_comp((packet.chunkCoordinates >> 20) & 0x3FFFFF, 22)
-				y = twos_comp((packet.chunkCoordinates      ) & 0xFFFFF , 20)
-				for loc in packet.records:
-					state = loc >> 12
-					dx = ((loc & 0x0FFF) >> 8 ) & 0x0F
-					dz = ((loc & 0x0FFF) >> 4 ) & 0x0F
-					dy = ((loc & 0x0FFF)      ) & 0x0F
-					pos = BlockPos(16*x + dx, 16*y + dy, 16*z + dz)
-					self.world.put_block(pos.i_x, pos.i_y, pos.i_z, state)
-					self.run_callbacks(BlockUpdateEvent, BlockUpdateEvent(pos, state))
+				x = twos_comp((packet.chunkCoordinates >> 42) & 0x3FFFFF, 22) * 16
+				z = twos_comp((packet.chunkCoordinates >> 20) & 0x3FFFFF, 22) * 16
+				y = twos_comp((packet.chunkCoordinates      ) & 0xFFFFF , 20) * 16
+				xs = array('i', [ x + ((r >> 8) & 0x0F) for r in records ])
+				ys = array('i', [ y + (r & 0x0F) for r in records ])
+				zs = array('i', [ z + ((r >> 4) & 0x0F) for r in records ])
+				states = array('i', [ r >> 12 for r in records ])
 			else:
 				self.logger.error("Cannot process MultiBlockChange for protocol %d", self.dispatcher.proto)
+				return
+			batch = BlockBatchUpdateEvent(xs, ys, zs, states)
+			self._world_op(lambda _: store_blocks(batch))
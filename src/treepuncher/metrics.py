@@ -0,0 +1,274 @@
+import asyncio
+import logging
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# seconds, from half a millisecond up to ten seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+	"""counts observations in fixed buckets, cheap enough to call for every packet"""
+	kind = "histogram"
+
+	name : str
+	help : str
+	buckets : Sequence[float]
+	counts : List[int]
+	count : int
+	sum : float
+	max : float
+
+	def __init__(self, name:str, buckets:Sequence[float] = LATENCY_BUCKETS, help:str = ""):
+		self.name = name
+		self.help = help
+		self.buckets = tuple(sorted(buckets))
+		self.counts = [0] * (len(self.buckets) + 1)  # last one counts values above every bucket
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value:float):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+
+	def reset(self):
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def quantile(self, q:float) -> float:
+		"""upper bound of the bucket containing the q-th quantile"""
+		if not self.count:
+			return 0.0
+		rank = q * self.count
+		seen = 0
+		for bound, n in zip(self.buckets, self.counts):
+			seen += n
+			if seen >= rank:
+				return min(bound, self.max)
+		return self.max
+
+	def summary(self) -> Dict[str, float]:
+		return {
+			"count": self.count,
+			"mean": self.sum / self.count if self.count else 0.0,
+			"p50": self.quantile(0.5),
+			"p99": self.quantile(0.99),
+			"max": self.max,
+		}
+
+	def __str__(self) -> str:
+		s = self.summary()
+		return f"{self.name}: {s['count']} samples, mean {s['mean']*1000:.2f}ms, " \
+			f"p50 <= {s['p50']*1000:.2f}ms, p99 <= {s['p99']*1000:.2f}ms, max {s['max']*1000:.2f}ms"
+
+	def samples(self, labels:str) -> Iterator[Tuple[str, str, float]]:
+		seen = 0
+		sep = "," if labels else ""
+		for bound, n in zip(self.buckets, self.counts):
+			seen += n
+			yield "_bucket", f'{labels}{sep}le="{bound}"', seen
+		yield "_bucket", f'{labels}{sep}le="+Inf"', self.count
+		yield "_sum", labels, self.sum
+		yield "_count", labels, self.count
+
+	def describe(self) -> str:
+		return str(self)
+
+def _escape(value:str) -> str:
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class Counter:
+	"""monotonic total, optionally split by one label (e.g. packet type)"""
+	kind = "counter"
+
+	name : str
+	help : str
+	label : Optional[str]
+	values : Dict[str, float]
+
+	def __init__(self, name:str, help:str = "", label:Optional[str] = None):
+		self.name = name
+		self.help = help
+		self.label = label
+		self.values = {}
+
+	@property
+	def total(self) -> float:
+		return sum(self.values.values())
+
+	def inc(self, amount:float = 1, key:str = ""):
+		self.values[key] = self.values.get(key, 0) + amount
+
+	def reset(self):
+		self.values = {}
+
+	def samples(self, labels:str) -> Iterator[Tuple[str, str, float]]:
+		if self.label is None:
+			yield "", labels, self.values.get("", 0)
+			return
+		sep = "," if labels else ""
+		for key, value in self.values.items():
+			yield "", f'{labels}{sep}{self.label}="{_escape(key)}"', value
+
+	def describe(self) -> str:
+		if self.label is None or not self.values:
+			return f"{self.name}: {self.total:g}"
+		top = sorted(self.values.items(), key=lambda kv: kv[1], reverse=True)[:3]
+		return f"{self.name}: {self.total:g} (" + ', '.join(f"{k} {v:g}" for k, v in top) + ")"
+
+class Gauge:
+	"""current value, either set explicitly or read from fn when collected"""
+	kind = "gauge"
+
+	name : str
+	help : str
+	value : float
+
+	_fn : Optional[Callable[[], float]]
+
+	def __init__(self, name:str, help:str = "", fn:Optional[Callable[[], float]] = None):
+		self.name = name
+		self.help = help
+		self.value = 0.0
+		self._fn = fn
+
+	def set(self, value:float):
+		self.value = value
+
+	def inc(self, amount:float = 1):
+		self.value += amount
+
+	def dec(self, amount:float = 1):
+		self.value -= amount
+
+	def get(self) -> float:
+		return self._fn() if self._fn is not None else self.value
+
+	def samples(self, labels:str) -> Iterator[Tuple[str, str, float]]:
+		yield "", labels, self.get()
+
+	def describe(self) -> str:
+		return f"{self.name}: {self.get():g}"
+
+Metric = Union[Counter, Gauge, Histogram]
+
+class MetricsRegistry:
+	"""metrics of one client. Labels are added to every sample, to tell clients apart on a shared endpoint"""
+	prefix : str
+	labels : Dict[str, str]
+	metrics : Dict[str, Metric]
+
+	def __init__(self, prefix:str = "treepuncher_", **labels:str):
+		self.prefix = prefix
+		self.labels = labels
+		self.metrics = {}
+
+	def add(self, metric:Metric) -> Metric:
+		if metric.name in self.metrics:
+			raise ValueError(f"Metric '{metric.name}' already registered")
+		self.metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name:str, help:str = "", label:Optional[str] = None) -> Counter:
+		return self.add(Counter(name, help=help, label=label))  # type: ignore
+
+	def gauge(self, name:str, help:str = "", fn:Optional[Callable[[], float]] = None) -> Gauge:
+		return self.add(Gauge(name, help=help, fn=fn))  # type: ignore
+
+	def histogram(self, name:str, help:str = "", buckets:Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+		return self.add(Histogram(name, buckets=buckets, help=help))  # type: ignore
+
+	def report(self) -> str:
+		return '\n'.join(m.describe() for m in self.metrics.values())
+
+def render(registries:Iterable[MetricsRegistry]) -> str:
+	"""Prometheus text exposition of all given registries, each family described once"""
+	families : Dict[str, Tuple[str, str, List[str]]] = {}
+	for registry in registries:
+		labels = ','.join(f'{k}="{_escape(v)}"' for k, v in registry.labels.items())
+		for metric in registry.metrics.values():
+			name = registry.prefix + metric.name
+			if name not in families:
+				families[name] = (metric.kind, metric.help, [])
+			lines = families[name][2]
+			for suffix, sample_labels, value in metric.samples(labels):
+				lines.append(f"{name}{suffix}{{{sample_labels}}} {value!r}" if sample_labels else f"{name}{suffix} {value!r}")
+	out = []
+	for name, (kind, help, lines) in families.items():
+		if help:
+			out.append(f"# HELP {name} {help}")
+		out.append(f"# TYPE {name} {kind}")
+		out.extend(lines)
+	return '\n'.join(out) + '\n'
+
+_SERVERS : Dict[Tuple[str, int], 'MetricsServer'] = {}
+
+class MetricsServer:
+	"""minimal http endpoint serving metrics in Prometheus format. Clients in the same process share it"""
+	host : str
+	port : int
+	registries : List[MetricsRegistry]
+	logger : logging.Logger
+
+	_server : Optional[asyncio.AbstractServer]
+
+	def __init__(self, host:str, port:int):
+		self.host = host
+		self.port = port
+		self.registries = []
+		self.logger = logging.getLogger("metrics")
+		self._server = None
+
+	@classmethod
+	async def attach(cls, registry:MetricsRegistry, port:int, host:str = "127.0.0.1") -> 'MetricsServer':
+		key = (host, port)
+		if key not in _SERVERS:
+			server = cls(host, port)
+			await server.start()  # raises OSError if port is taken, before being shared
+			_SERVERS[key] = server
+		server = _SERVERS[key]
+		server.registries.append(registry)
+		return server
+
+	async def detach(self, registry:MetricsRegistry):
+		if registry in self.registries:
+			self.registries.remove(registry)
+		if not self.registries:
+			_SERVERS.pop((self.host, self.port), None)
+			await self.stop()
+
+	async def start(self):
+		self._server = await asyncio.start_server(self._handle, self.host, self.port)
+		self.logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+	async def stop(self):
+		if self._server is not None:
+			self._server.close()
+			await self._server.wait_closed()
+			self._server = None
+
+	async def _handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+		try:
+			request = await asyncio.wait_for(reader.readline(), timeout=10)
+			while (await asyncio.wait_for(reader.readline(), timeout=10)).strip():
+				pass  # headers don't matter
+			parts = request.decode("latin-1").split()
+			if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+				status, body = "200 OK", render(self.registries).encode()
+			else:
+				status, body = "404 Not Found", b"not found\n"
+			writer.write(
+				f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+				f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+			)
+			await writer.drain()
+		except (asyncio.TimeoutError, ConnectionError):
+			pass
+		finally:
+			writer.close()
@@ -1,10 +1,12 @@
 import asyncio
 import logging
+from time import perf_counter
 from typing import List, Callable, Optional, TYPE_CHECKING
 if TYPE_CHECKING:
 	from .treepuncher import Treepuncher
 
 from .addon import Addon
+from .metrics import Counter, Histogram
 
 class Provider(Addon):
 	async def notify(self, text, log:bool = False, **kwargs):
@@ -15,12 +17,18 @@ class Notifier:
 	_providers : List[Provider]
 	_client : 'Treepuncher'
 	logger : logging.Logger
+	sent : Counter
+	failed : Counter
+	latency : Histogram
 
 	def __init__(self, client:'Treepuncher'):
 		self._report_functions = []
 		self._providers = []
 		self._client = client
 		self.logger = client.logger.getChild("notifier")
+		self.sent = Counter("notifications_total", help="notifications sent, logs included", label="kind")
+		self.failed = Counter("notifications_failed_total", help="notifications some provider couldn't deliver")
+		self.latency = Histogram("notify_latency", help="seconds to deliver a notification to every provider")
 	
 	@property
 	def providers(self) -> List[Provider]:
@@ -44,9 +52,17 @@ class Notifier:
 
 	async def notify(self, text, log:bool = False, **kwargs):
 		self.logger.info("%s %s (%s)", "[n]" if log else "[N]", text, str(kwargs))
-		await asyncio.gather(
-			*(p.notify(text, log=log, **kwargs) for p in self.providers)
-		)
+		self.sent.inc(1, "log" if log else "notify")
+		start = perf_counter()
+		try:
+			await asyncio.gather(
+				*(p.notify(text, log=log, **kwargs) for p in self.providers)
+			)
+		except Exception:
+			self.failed.inc()
+			raise
+		finally:
+			self.latency.observe(perf_counter() - start)
 
 	async def start(self):
 		await asyncio.gather(
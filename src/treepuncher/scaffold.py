@@ -1,6 +1,11 @@
+import asyncio
+import logging
+
+from time import time, perf_counter
+from collections import deque
 from configparser import ConfigParser, SectionProxy
 
-from typing import Type, Any
+from typing import Type, Any, Callable, Optional, Deque
 
 from aiocraft.client import AbstractMinecraftClient
 from aiocraft.util import helpers
@@ -13,6 +18,11 @@ from aiocraft.proto.play.serverbound import PacketKeepAlive as PacketKeepAliveRe
 from .traits import CallbacksHolder, Runnable
 from .events import ConnectedEvent, DisconnectedEvent
 from .events.base import BaseEvent
+from .metrics import Histogram, Counter, MetricsRegistry
+from .capture import PacketRecorder
+
+# packets which need some handling from the client itself before being dispatched
+HANDLED_PACKETS = frozenset((PacketSetCompression, PacketKeepAlive, PacketKickDisconnect))
 
 class ConfigObject:
 	def __getitem__(self, key: str) -> Any:
@@ -26,40 +36,109 @@ class Scaffold(
 	entity_id : int
 
 	config: ConfigParser
+	keep_alive_latency : Histogram
+	packets_received : Counter
+	metrics : MetricsRegistry
+
+	_backlog : Deque[Packet]  # waiting to be delivered to addon queues
+	_backlog_size : int
+	_backlog_drainer : Optional[asyncio.Task]
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.keep_alive_latency = Histogram("keep_alive_latency", help="seconds from reading a keep alive to answering it")
+		self.packets_received = Counter("packets_total", help="packets processed, by type", label="type")
+		self._backlog = deque()
+		# packets buffered while addon queues are congested, so priority packets keep flowing. 0 blocks reads instead
+		self._backlog_size = self.cfg.getint("packet_backlog", fallback=4096)
+		self._backlog_drainer = None
+		self.metrics = MetricsRegistry()
+		self.metrics.add(self.packets_received)
+		self.metrics.add(self.keep_alive_latency)
+		self.metrics.add(self.callback_latency)
+		self.metrics.gauge("callback_tasks", help="callbacks running as tasks", fn=lambda: len(self._tasks))
+		self.metrics.gauge("callback_queued", help="callbacks waiting in addon queues", fn=lambda: sum(q.depth for q in set(self._queues.values())))
+		self.metrics.gauge("packet_backlog", help="packets parked while addon queues are congested", fn=lambda: len(self._backlog))
 
 	@property
 	def cfg(self) -> SectionProxy:
 		return SectionProxy(self.config, "Treepuncher")
 
-	def on_packet(self, packet:Type[Packet]):
+	def on_packet(
+		self,
+		packet:Type[Packet],
+		inline:bool = False,
+		coalesce:Optional[Callable[[Packet], Any]] = None,
+		priority:bool = False,
+	):
 		def decorator(fun):
-			return self.register(packet, fun)
+			return self.register(packet, fun, inline=inline, coalesce=coalesce, priority=priority)
 		return decorator
 
-	def on(self, event:Type[BaseEvent]):
+	def on(self, event:Type[BaseEvent], inline:bool = False):
 		def decorator(fun):
-			return self.register(event, fun)
+			return self.register(event, fun, inline=inline)
 		return decorator
 
+	async def _drain_backlog(self):
+		while self._backlog:
+			if self._congested:
+				await self.wait_congested()
+			packet = self._backlog.popleft()
+			self.run_queued_callbacks(type(packet), packet)
+		self._backlog_drainer = None
+
 	#Override
 	async def _play(self) -> bool:
 		assert self.dispatcher is not None
 		self.dispatcher.promote(ConnectionState.PLAY)
 		self.run_callbacks(ConnectedEvent, ConnectedEvent())
-		async for packet in self.dispatcher.packets():
-			self.logger.debug("[ * ] Processing %s", packet.__class__.__name__)
-			if isinstance(packet, PacketSetCompression):
-				self.logger.info("Compression updated")
-				self.dispatcher.update_compression_threshold(packet.threshold)
-			elif isinstance(packet, PacketKeepAlive):
-				if self.cfg.getboolean("send_keep_alive", fallback=True):
-					keep_alive_packet = PacketKeepAliveResponse(keepAliveId=packet.keepAliveId)
-					await self.dispatcher.write(keep_alive_packet)
-			elif isinstance(packet, PacketKickDisconnect):
-				self.logger.error("Kicked while in game : %s", helpers.parse_chat(packet.reason))
-				break
-			self.run_callbacks(type(packet), packet)
-			self.run_callbacks(Packet, packet)
+		debug = self.logger.isEnabledFor(logging.DEBUG)
+		send_keep_alive = self.cfg.getboolean("send_keep_alive", fallback=True)
+		capture = self.cfg.get("capture_file", fallback="")  # may contain {time}, to keep one file per session
+		recorder = PacketRecorder(capture.format(time=int(time())), self.dispatcher.proto) if capture else None
+		try:
+			async for packet in self.dispatcher.packets():
+				received = perf_counter()  # keep alive latency includes everything done with the packet before answering
+				packet_type = type(packet)
+				self.packets_received.inc(1, packet_type.__name__)
+				if recorder is not None:
+					recorder.record(packet)
+				if debug:
+					self.logger.debug("[ * ] Processing %s", packet_type.__name__)
+				if packet_type in HANDLED_PACKETS:
+					if packet_type is PacketSetCompression:
+						self.logger.info("Compression updated")
+						self.dispatcher.update_compression_threshold(packet.threshold)
+					elif packet_type is PacketKeepAlive:
+						if send_keep_alive:
+							keep_alive_packet = PacketKeepAliveResponse(keepAliveId=packet.keepAliveId)
+							await self.dispatcher.write(keep_alive_packet)
+							self.keep_alive_latency.observe(perf_counter() - received)
+					elif packet_type is PacketKickDisconnect:
+						self.logger.error("Kicked while in game : %s", helpers.parse_chat(packet.reason))
+						break
+				# latency critical, never wait behind other packets. Only addon queues lag behind: game state handlers
+				# never get parked, so they already ran for every older packet
+				self.run_priority_callbacks(packet_type, packet)
+				if self._backlog or (self._congested and self._backlog_size > 0):
+					# some addon queue is full: keep reading and handling game state, park packets for addon queues only
+					if not self.run_unqueued_callbacks(packet_type, packet):
+						continue
+					self._backlog.append(packet)
+					if self._backlog_drainer is None:
+						self._backlog_drainer = asyncio.get_event_loop().create_task(self._drain_backlog())
+					if len(self._backlog) >= self._backlog_size > 0:  # buffered too much, stop reading for a while
+						await self._backlog_drainer
+					continue
+				self.run_callbacks(packet_type, packet)  # dispatch table also includes Packet-wide listeners
+				if self._congested and self._backlog_size <= 0:  # no backlog, stop reading until queues catch up
+					await self.wait_congested()
+		finally:
+			if recorder is not None:
+				recorder.close()
+				self.logger.info("Captured %d packets to %s", recorder.count, recorder.path)
+		if self._backlog_drainer is not None:  # deliver everything received before disconnecting
+			await self._backlog_drainer
 		self.run_callbacks(DisconnectedEvent, DisconnectedEvent())
 		return False
-
@@ -0,0 +1,189 @@
+import json
+import struct
+
+from datetime import datetime
+from typing import Any, Dict, Tuple, Union
+
+class Codec:
+	tag : str
+
+	def encode(self, val:Any) -> Union[str, bytes]:
+		raise NotImplementedError
+
+	def decode(self, data:Union[str, bytes]) -> Any:
+		raise NotImplementedError
+
+class JsonCodec(Codec):
+	tag = "json"
+
+	def encode(self, val:Any) -> str:
+		return json.dumps(val, default=str)
+
+	def decode(self, data:Union[str, bytes]) -> Any:
+		return json.loads(data)
+
+# type tags for BinaryCodec, loosely modeled after msgpack. Bytes below 0x80 are small ints
+_NONE, _FALSE, _TRUE, _INT, _BIGINT, _FLOAT, _STR, _BYTES = range(0x80, 0x88)
+_LIST, _TUPLE, _DICT, _SET, _DATETIME, _FLOAT_ARRAY, _INT_ARRAY = range(0x88, 0x8F)
+
+_INT64 = struct.Struct(">q")
+_DOUBLE = struct.Struct(">d")
+
+def _write_varint(out:bytearray, val:int):
+	while val >= 0x80:
+		out.append((val & 0x7F) | 0x80)
+		val >>= 7
+	out.append(val)
+
+def _read_varint(data:bytes, off:int) -> Tuple[int, int]:
+	val, shift = 0, 0
+	while True:
+		b = data[off]
+		off += 1
+		val |= (b & 0x7F) << shift
+		if not b & 0x80:
+			return val, off
+		shift += 7
+
+class BinaryCodec(Codec):
+	"""compact typed binary format, keeps tuples, sets, bytes, datetimes and non-string dict keys.
+	Lists made only of floats or only of ints are packed as fixed width arrays"""
+	tag = "bin"
+
+	def encode(self, val:Any) -> bytes:
+		out = bytearray()
+		self._encode(val, out)
+		return bytes(out)
+
+	def decode(self, data:Union[str, bytes]) -> Any:
+		val, _ = self._decode(bytes(data), 0)
+		return val
+
+	def _encode(self, val:Any, out:bytearray):
+		t = type(val)
+		if val is None:
+			out.append(_NONE)
+		elif t is bool:
+			out.append(_TRUE if val else _FALSE)
+		elif t is int:
+			if 0 <= val < 0x80:
+				out.append(val)
+			elif -(1 << 63) <= val < (1 << 63):
+				out.append(_INT)
+				out += _INT64.pack(val)
+			else:
+				raw = val.to_bytes((val.bit_length() + 8) // 8, 'big', signed=True)
+				out.append(_BIGINT)
+				_write_varint(out, len(raw))
+				out += raw
+		elif t is float:
+			out.append(_FLOAT)
+			out += _DOUBLE.pack(val)
+		elif t is str:
+			raw = val.encode('utf-8')
+			out.append(_STR)
+			_write_varint(out, len(raw))
+			out += raw
+		elif t is bytes or t is bytearray:
+			out.append(_BYTES)
+			_write_varint(out, len(val))
+			out += val
+		elif t is list:
+			if len(val) > 1 and all(type(x) is float for x in val):
+				out.append(_FLOAT_ARRAY)
+				_write_varint(out, len(val))
+				out += struct.pack(f">{len(val)}d", *val)
+			elif len(val) > 1 and all(type(x) is int and -(1 << 63) <= x < (1 << 63) for x in val):
+				out.append(_INT_ARRAY)
+				_write_varint(out, len(val))
+				out += struct.pack(f">{len(val)}q", *val)
+			else:
+				out.append(_LIST)
+				self._encode_items(val, out)
+		elif t is tuple:
+			out.append(_TUPLE)
+			self._encode_items(val, out)
+		elif t is set or t is frozenset:
+			out.append(_SET)
+			self._encode_items(val, out)
+		elif t is dict:
+			out.append(_DICT)
+			_write_varint(out, len(val))
+			for k, v in val.items():
+				self._encode(k, out)
+				self._encode(v, out)
+		elif t is datetime:
+			self._encode_tagged(_DATETIME, val.isoformat(), out)
+		else:  # same fallback as json codec
+			self._encode(str(val), out)
+
+	def _encode_items(self, val:Any, out:bytearray):
+		_write_varint(out, len(val))
+		for x in val:
+			self._encode(x, out)
+
+	def _encode_tagged(self, tag:int, text:str, out:bytearray):
+		raw = text.encode('utf-8')
+		out.append(tag)
+		_write_varint(out, len(raw))
+		out += raw
+
+	def _decode(self, data:bytes, off:int) -> Tuple[Any, int]:
+		tag = data[off]
+		off += 1
+		if tag < 0x80:
+			return tag, off
+		if tag == _NONE:
+			return None, off
+		if tag == _FALSE:
+			return False, off
+		if tag == _TRUE:
+			return True, off
+		if tag == _INT:
+			return _INT64.unpack_from(data, off)[0], off + 8
+		if tag == _FLOAT:
+			return _DOUBLE.unpack_from(data, off)[0], off + 8
+		length, off = _read_varint(data, off)
+		if tag == _STR:
+			return data[off:off+length].decode('utf-8'), off + length
+		if tag == _BYTES:
+			return data[off:off+length], off + length
+		if tag == _BIGINT:
+			return int.from_bytes(data[off:off+length], 'big', signed=True), off + length
+		if tag == _DATETIME:
+			return datetime.fromisoformat(data[off:off+length].decode('utf-8')), off + length
+		if tag == _FLOAT_ARRAY:
+			return list(struct.unpack_from(f">{length}d", data, off)), off + 8 * length
+		if tag == _INT_ARRAY:
+			return list(struct.unpack_from(f">{length}q", data, off)), off + 8 * length
+		if tag == _DICT:
+			res = {}
+			for _ in range(length):
+				k, off = self._decode(data, off)
+				res[k], off = self._decode(data, off)
+			return res, off
+		items = []
+		for _ in range(length):
+			x, off = self._decode(data, off)
+			items.append(x)
+		if tag == _LIST:
+			return items, off
+		if tag == _TUPLE:
+			return tuple(items), off
+		if tag == _SET:
+			return set(items), off
+		raise ValueError(f"Unknown type tag 0x{tag:02x}")
+
+CODECS : Dict[str, Codec] = {}
+
+def register_codec(codec:Codec) -> Codec:
+	CODECS[codec.tag] = codec
+	return codec
+
+def get_codec(tag:str) -> Codec:
+	if tag not in CODECS:
+		raise ValueError(f"Unknown storage codec '{tag}'")
+	return CODECS[tag]
+
+JSON = register_codec(JsonCodec())
+BINARY = register_codec(BinaryCodec())
@@ -1,13 +1,72 @@
-import os
+import re
 import json
+import queue
+import asyncio
 import sqlite3
+import logging
+import warnings
+import threading
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Tuple, Callable, Iterable, Iterator, AsyncIterator, Union
 from datetime import datetime
+from time import perf_counter
+
+from .serialization import Codec, JSON, get_codec
+from .metrics import Histogram
 
 __DATE_FORMAT__ : str = "%Y-%m-%d %H:%M:%S.%f"
 
+JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+SYNCHRONOUS_LEVELS = ("off", "normal", "full", "extra")
+NAMESPACE_MATCHER = re.compile(r"^[A-Za-z0-9_]*$")
+NAMESPACE_INVALID_CHARS = re.compile(r"[^A-Za-z0-9_]")
+
+def namespace_for(name:str) -> str:
+	"""valid storage namespace derived from a client name, 'bot-1' becomes 'bot_1'"""
+	return NAMESPACE_INVALID_CHARS.sub("_", name)
+
+def _create_tables(cur:sqlite3.Cursor, prefix:str):
+	cur.execute(f'CREATE TABLE IF NOT EXISTS {prefix}system (name TEXT PRIMARY KEY, version TEXT, start_time LONG)')
+	cur.execute(f'CREATE TABLE IF NOT EXISTS {prefix}documents (name TEXT PRIMARY KEY, value TEXT)')
+	cur.execute(f'CREATE TABLE IF NOT EXISTS {prefix}authenticator (date TEXT PRIMARY KEY, token TEXT, legacy BOOL)')
+
+def _namespace_documents(cur:sqlite3.Cursor, prefix:str):
+	# used to move '<addon>_<key>' documents into addon tables, guessing addon names from keys.
+	# That also moved core documents: now opt-in, see StorageDriver.migrate_addon_documents
+	pass
+
+def _add_codec_column(cur:sqlite3.Cursor, prefix:str):
+	# values are now BLOBs encoded by the codec named in each row, existing ones are all json
+	for (table,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+		if table == f"{prefix}documents" or table.startswith(f"{prefix}documents_"):
+			quoted = table.replace('"', '""')  # old migration script left tables named literally 'documents_{addon}'
+			cur.execute(f'ALTER TABLE "{quoted}" ADD COLUMN codec TEXT NOT NULL DEFAULT \'json\'')
+
+# schema version N is reached by applying MIGRATIONS[N-1], never edit or reorder these
+MIGRATIONS : List[Callable[[sqlite3.Cursor, str], None]] = [
+	_create_tables,
+	_namespace_documents,
+	_add_codec_column,
+]
+
+# sqlite limits how many parameters a single statement can bind
+MAX_QUERY_PARAMS = 900
+
+def _prefix_end(prefix:str) -> Optional[str]:
+	# smallest string greater than any string starting with prefix
+	if not prefix:
+		return None
+	return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# documents are buffered as (encoded value, codec tag), or None when pending deletion
+Document = Optional[Tuple[Union[str, bytes], str]]
+
+def _decode(doc:Document) -> Optional[Any]:
+	return get_codec(doc[1]).decode(doc[0]) if doc is not None else None
+
 @dataclass
 class SystemState:
 	name : str
@@ -20,70 +79,214 @@ class AuthenticatorState:
 	token : Dict[str, Any]
 	legacy : bool = False
 
-class AddonStorage:
-	# TODO this uses py formatting in SQL queries, can we avoid it?
-	db: sqlite3.Connection
-	name: str
+class StorageBackend:
+	"""where documents and session state are actually kept. Implementations must be thread safe,
+	since buffered writes are applied from a background thread"""
 
-	def __init__(self, db:sqlite3.Connection, name:str):
-		self.db = db
-		self.name = name
-		self.db.cursor().execute(f'CREATE TABLE IF NOT EXISTS documents_{self.name} (name TEXT PRIMARY KEY, value TEXT)')
-		self.db.commit()
+	def create_table(self, table:str) -> None:
+		raise NotImplementedError
 
-	# fstrings in queries are evil but if you go to this length to fuck up you kinda deserve it :)
-	def get(self, key:str) -> Optional[Any]:
-		res = self.db.cursor().execute(f"SELECT * FROM documents_{self.name} WHERE name = ?", (key,)).fetchall()
-		return json.loads(res[0][1]) if res else None
+	def get(self, table:str, keys:List[str]) -> Dict[str, Document]:
+		raise NotImplementedError
 
-	def put(self, key:str, val:Any) -> None:
-		cur = self.db.cursor()
-		cur.execute(f"DELETE FROM documents_{self.name} WHERE name = ?", (key,))
-		cur.execute(f"INSERT INTO documents_{self.name} VALUES (?, ?)", (key, json.dumps(val, default=str),))
-		self.db.commit()
+	def write(self, batch:Dict[str, Dict[str, Document]]) -> None:
+		"""apply all given upserts and deletions (None documents) atomically"""
+		raise NotImplementedError
 
-class StorageDriver:
-	name : str
-	db : sqlite3.Connection
+	def scan(self, table:str, lower:str, inclusive:bool, upper:Optional[str], limit:int) -> List[Tuple[str, Document]]:
+		raise NotImplementedError
 
-	def __init__(self, name:str):
-		self.name = name
-		init = not os.path.isfile(name)
-		self.db = sqlite3.connect(name)
-		if init:
-			self._init_db()
+	def system(self) -> Optional[SystemState]:
+		raise NotImplementedError
 
-	def __del__(self):
-		self.close()
+	def set_system(self, state:SystemState) -> None:
+		raise NotImplementedError
+
+	def auth(self) -> Optional[AuthenticatorState]:
+		raise NotImplementedError
+
+	def set_auth(self, state:AuthenticatorState) -> None:
+		raise NotImplementedError
 
 	def close(self) -> None:
-		self.db.close()
+		pass
 
-	def _init_db(self):
-		cur = self.db.cursor()
-		cur.execute('CREATE TABLE system (name TEXT PRIMARY KEY, version TEXT, start_time LONG)')
-		cur.execute('CREATE TABLE documents (name TEXT PRIMARY KEY, value TEXT)')
-		cur.execute('CREATE TABLE authenticator (date TEXT PRIMARY KEY, token TEXT, legacy BOOL)')
-		self.db.commit()
+class ConnectionPool:
+	"""sqlite connections to one file, shared by every backend using that file in this process"""
+	path : str
+	size : int
+	journal_mode : str
+	synchronous : str
 
-	def _set_state(self, state:SystemState):
-		cur = self.db.cursor()
-		cur.execute('DELETE FROM system')
-		cur.execute('INSERT INTO system VALUES (?, ?, ?)', (state.name, state.version, int(state.start_time)))
-		self.db.commit()
+	_idle : "queue.LifoQueue[sqlite3.Connection]"
+	_created : int
+	_users : int
+	_lock : threading.Lock
 
-	def _set_auth(self, state:AuthenticatorState):
-		cur = self.db.cursor()
-		cur.execute('DELETE FROM authenticator')
-		cur.execute('INSERT INTO authenticator VALUES (?, ?, ?)', (state.date.strftime(__DATE_FORMAT__), json.dumps(state.token), state.legacy))
-		self.db.commit()
+	_pools : Dict[str, 'ConnectionPool'] = {}
+	_pools_lock = threading.Lock()
+
+	def __init__(self, path:str, size:int = 4, journal_mode:str = "wal", synchronous:str = "normal"):
+		if journal_mode.lower() not in JOURNAL_MODES:
+			raise ValueError(f"Invalid journal mode '{journal_mode}'")
+		if synchronous.lower() not in SYNCHRONOUS_LEVELS:
+			raise ValueError(f"Invalid synchronous level '{synchronous}'")
+		self.path = path
+		self.size = max(size, 1)
+		self.journal_mode = journal_mode.lower()
+		self.synchronous = synchronous.lower()
+		self._idle = queue.LifoQueue()
+		self._created = 0
+		self._users = 0
+		self._lock = threading.Lock()
 
-	def addon_storage(self, name:str) -> AddonStorage:
-		return AddonStorage(self.db, name)
+	@classmethod
+	def shared(cls, path:str, **kwargs) -> 'ConnectionPool':
+		with cls._pools_lock:
+			if path not in cls._pools:
+				cls._pools[path] = cls(path, **kwargs)
+			pool = cls._pools[path]
+			pool._users += 1
+			return pool
+
+	def release(self):
+		with self._pools_lock:
+			self._users -= 1
+			if self._users > 0:
+				return
+			if self._pools.get(self.path) is self:
+				self._pools.pop(self.path)
+		while not self._idle.empty():
+			self._idle.get_nowait().close()
+
+	def _connect(self) -> sqlite3.Connection:
+		# IMMEDIATE: take the write lock when a transaction starts, so concurrent writers
+		# from other processes wait on busy timeout instead of failing to upgrade their lock
+		db = sqlite3.connect(self.path, timeout=30, isolation_level="IMMEDIATE", check_same_thread=False)
+		db.execute(f"PRAGMA journal_mode = {self.journal_mode}")  # can't bind parameters in pragmas, values are validated
+		db.execute(f"PRAGMA synchronous = {self.synchronous}")
+		return db
+
+	@contextmanager
+	def connection(self) -> Iterator[sqlite3.Connection]:
+		try:
+			db = self._idle.get_nowait()
+		except queue.Empty:
+			with self._lock:
+				create = self._created < self.size
+				if create:
+					self._created += 1
+			db = self._connect() if create else self._idle.get()
+		try:
+			yield db
+		finally:
+			if db.in_transaction:
+				db.rollback()
+			self._idle.put(db)
+
+class SqliteBackend(StorageBackend):
+	"""documents stored in a sqlite file. Many clients can share the same file, each in its own namespace"""
+	path : str
+	namespace : str
+	prefix : str
+	pool : ConnectionPool
+
+	_db : Optional[sqlite3.Connection]
+
+	def __init__(self, path:str, namespace:str = "", pool_size:int = 4, journal_mode:str = "wal", synchronous:str = "normal"):
+		if not NAMESPACE_MATCHER.match(namespace):
+			raise ValueError(f"Invalid storage namespace '{namespace}'")
+		self.path = path
+		self.namespace = namespace
+		self.prefix = f"{namespace}__" if namespace else ""
+		self._db = None
+		self.pool = ConnectionPool.shared(path, size=pool_size, journal_mode=journal_mode, synchronous=synchronous)
+		self._migrate()
+
+	@property
+	def db(self) -> sqlite3.Connection:
+		"""dedicated connection for code still issuing its own queries. Tables of namespaced storages are prefixed!"""
+		if self._db is None:
+			self._db = self.pool._connect()
+		return self._db
+
+	def close(self):
+		if self._db is not None:
+			self._db.close()
+			self._db = None
+		self.pool.release()
+
+	def _table(self, table:str) -> str:
+		return self.prefix + table
+
+	def _version(self, cur:sqlite3.Cursor) -> int:
+		tables = set(r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall())
+		if self._table("schema_version") in tables:
+			return cur.execute(f"SELECT version FROM {self._table('schema_version')}").fetchone()[0]
+		if self._table("system") in tables:  # created before schema was versioned
+			return 1
+		return 0
+
+	@property
+	def schema_version(self) -> int:
+		with self.pool.connection() as db:
+			return self._version(db.cursor())
+
+	def _migrate(self):
+		with self.pool.connection() as db:
+			cur = db.cursor()
+			if self._version(cur) >= len(MIGRATIONS):
+				return
+			cur.execute("BEGIN IMMEDIATE")  # other processes may be migrating this same file right now
+			version = self._version(cur)
+			for migration in MIGRATIONS[version:]:
+				migration(cur, self.prefix)
+			cur.execute(f"CREATE TABLE IF NOT EXISTS {self._table('schema_version')} (version INTEGER NOT NULL)")
+			cur.execute(f"DELETE FROM {self._table('schema_version')}")
+			cur.execute(f"INSERT INTO {self._table('schema_version')} VALUES (?)", (len(MIGRATIONS),))
+			db.commit()
+
+	def create_table(self, table:str):
+		with self.pool.connection() as db:
+			db.execute(f"CREATE TABLE IF NOT EXISTS {self._table(table)} (name TEXT PRIMARY KEY, value BLOB, codec TEXT NOT NULL DEFAULT 'json')")
+			db.commit()
+
+	def get(self, table:str, keys:List[str]) -> Dict[str, Document]:
+		res : Dict[str, Document] = {}
+		with self.pool.connection() as db:
+			cur = db.cursor()
+			for i in range(0, len(keys), MAX_QUERY_PARAMS):
+				chunk = keys[i:i+MAX_QUERY_PARAMS]
+				query = f"SELECT name, value, codec FROM {self._table(table)} WHERE name IN ({', '.join('?' * len(chunk))})"
+				for key, data, tag in cur.execute(query, chunk).fetchall():
+					res[key] = (data, tag)
+		return res
+
+	def write(self, batch:Dict[str, Dict[str, Document]]):
+		with self.pool.connection() as db:
+			cur = db.cursor()
+			for table, docs in batch.items():
+				cur.executemany(
+					f"INSERT INTO {self._table(table)} (name, value, codec) VALUES (?, ?, ?) "
+					"ON CONFLICT(name) DO UPDATE SET value = excluded.value, codec = excluded.codec",
+					[ (k, v[0], v[1]) for k, v in docs.items() if v is not None ]
+				)
+				cur.executemany(f"DELETE FROM {self._table(table)} WHERE name = ?", [ (k,) for k, v in docs.items() if v is None ])
+			db.commit()
+
+	def scan(self, table:str, lower:str, inclusive:bool, upper:Optional[str], limit:int) -> List[Tuple[str, Document]]:
+		query = f"SELECT name, value, codec FROM {self._table(table)} WHERE name {'>=' if inclusive else '>'} ?"
+		params : List[Any] = [lower]
+		if upper is not None:
+			query += " AND name < ?"
+			params.append(upper)
+		with self.pool.connection() as db:
+			rows = db.execute(query + " ORDER BY name LIMIT ?", params + [limit]).fetchall()
+		return [ (key, (data, tag)) for key, data, tag in rows ]
 
 	def system(self) -> Optional[SystemState]:
-		cur = self.db.cursor()
-		val = cur.execute('SELECT * FROM system').fetchall()
+		with self.pool.connection() as db:
+			val = db.execute(f'SELECT * FROM {self._table("system")}').fetchall()
 		if not val:
 			return None
 		return SystemState(
@@ -92,9 +295,16 @@ class StorageDriver:
 			start_time=val[0][2]
 		)
 
+	def set_system(self, state:SystemState):
+		with self.pool.connection() as db:
+			cur = db.cursor()
+			cur.execute(f'DELETE FROM {self._table("system")}')
+			cur.execute(f'INSERT INTO {self._table("system")} VALUES (?, ?, ?)', (state.name, state.version, int(state.start_time)))
+			db.commit()
+
 	def auth(self) -> Optional[AuthenticatorState]:
-		cur = self.db.cursor()
-		val = cur.execute('SELECT * FROM authenticator').fetchall()
+		with self.pool.connection() as db:
+			val = db.execute(f'SELECT * FROM {self._table("authenticator")}').fetchall()
 		if not val:
 			return None
 		return AuthenticatorState(
@@ -102,15 +312,438 @@ class StorageDriver:
 			token=json.loads(val[0][1]),
 			legacy=val[0][2] or False
 		)
-	
+
+	def set_auth(self, state:AuthenticatorState):
+		with self.pool.connection() as db:
+			cur = db.cursor()
+			cur.execute(f'DELETE FROM {self._table("authenticator")}')
+			cur.execute(
+				f'INSERT INTO {self._table("authenticator")} VALUES (?, ?, ?)',
+				(state.date.strftime(__DATE_FORMAT__), json.dumps(state.token), state.legacy)
+			)
+			db.commit()
+
+class MemoryBackend(StorageBackend):
+	"""keeps everything in process memory: a stand-in for an external key-value store, useful for tests"""
+	_tables : Dict[str, Dict[str, Tuple[Union[str, bytes], str]]]
+	_system : Optional[SystemState]
+	_auth : Optional[AuthenticatorState]
+	_lock : threading.Lock
+
+	def __init__(self):
+		self._tables = {}
+		self._system = None
+		self._auth = None
+		self._lock = threading.Lock()
+
+	def create_table(self, table:str):
+		with self._lock:
+			if table not in self._tables:
+				self._tables[table] = {}
+
+	def get(self, table:str, keys:List[str]) -> Dict[str, Document]:
+		with self._lock:
+			docs = self._tables.get(table, {})
+			return { k: docs[k] for k in keys if k in docs }
+
+	def write(self, batch:Dict[str, Dict[str, Document]]):
+		with self._lock:
+			for table, docs in batch.items():
+				stored = self._tables.setdefault(table, {})
+				for k, v in docs.items():
+					if v is None:
+						stored.pop(k, None)
+					else:
+						stored[k] = v
+
+	def scan(self, table:str, lower:str, inclusive:bool, upper:Optional[str], limit:int) -> List[Tuple[str, Document]]:
+		with self._lock:
+			docs = self._tables.get(table, {})
+			keys = sorted(
+				k for k in docs
+				if (k >= lower if inclusive else k > lower) and (upper is None or k < upper)
+			)
+			return [ (k, docs[k]) for k in keys[:limit] ]
+
+	def system(self) -> Optional[SystemState]:
+		return self._system
+
+	def set_system(self, state:SystemState):
+		self._system = state
+
+	def auth(self) -> Optional[AuthenticatorState]:
+		return self._auth
+
+	def set_auth(self, state:AuthenticatorState):
+		self._auth = state
+
+class AddonStorage:
+	name: str
+	table: str
+	codec: Codec
+	cache_size: int
+	hits: int
+	misses: int
+
+	_driver: 'StorageDriver'
+	_cache: 'OrderedDict[str, Any]'
+
+	def __init__(self, driver:Union['StorageDriver', sqlite3.Connection], name:str, cache_size:int = 0, codec:Codec = JSON):
+		if isinstance(driver, sqlite3.Connection):  # used to be built around a raw connection, open a driver on same file
+			path = driver.execute("PRAGMA database_list").fetchone()[2]
+			if not path:
+				raise ValueError("AddonStorage needs a file backed connection")
+			warnings.warn("AddonStorage(db, name) is deprecated, use StorageDriver.addon_storage(name)", DeprecationWarning, stacklevel=2)
+			driver = StorageDriver(path)
+		self._driver = driver
+		self.name = name
+		self.table = f"documents_{self.name}"
+		self.codec = codec
+		self.cache_size = cache_size
+		self.hits = 0
+		self.misses = 0
+		self._cache = OrderedDict()
+		self._driver.backend.create_table(self.table)
+
+	@property
+	def db(self) -> sqlite3.Connection:
+		return self._driver.db
+
 	def get(self, key:str) -> Optional[Any]:
-		val = self.db.cursor().execute("SELECT * FROM documents WHERE name = ?", (key,)).fetchall()
-		return json.loads(val[0][1]) if val else None
+		# cached values are returned as they are: mutating them without a put() only changes the cache!
+		if key in self._cache:
+			self.hits += 1
+			self._cache.move_to_end(key)
+			return self._cache[key]
+		self.misses += 1
+		val = self._driver._get(self.table, key)
+		if self.cache_size > 0:
+			self._cache[key] = val
+			if len(self._cache) > self.cache_size:
+				self._cache.popitem(last=False)
+		return val
+
+	def get_many(self, keys:Iterable[str]) -> Dict[str, Optional[Any]]:
+		res : Dict[str, Optional[Any]] = {}
+		missing = []
+		for key in keys:
+			if key in self._cache:
+				self.hits += 1
+				res[key] = self._cache[key]
+			else:
+				self.misses += 1
+				missing.append(key)
+		if missing:
+			fetched = self._driver._get_many(self.table, missing)
+			if self.cache_size > 0:
+				self._cache.update(fetched)
+				while len(self._cache) > self.cache_size:
+					self._cache.popitem(last=False)
+			res.update(fetched)
+		return res
 
 	def put(self, key:str, val:Any) -> None:
-		cur = self.db.cursor()
-		cur.execute("DELETE FROM documents WHERE name = ?", (key,))
-		cur.execute("INSERT INTO documents VALUES (?, ?)", (key, json.dumps(val, default=str)))
-		self.db.commit()
+		self._cache.pop(key, None)
+		self._driver._put(self.table, key, val, self.codec)
+
+	def put_many(self, items:Union[Dict[str, Any], Iterable[Tuple[str, Any]]]) -> None:
+		docs : Dict[str, Document] = {
+			k: (self.codec.encode(v), self.codec.tag)
+			for k, v in (items.items() if isinstance(items, dict) else items)
+		}
+		for key in docs:
+			self._cache.pop(key, None)
+		self._driver._write(self.table, docs)
+
+	def delete(self, key:str) -> None:
+		self._cache.pop(key, None)
+		self._driver._write(self.table, { key: None })
+
+	async def scan(self, prefix:str = "", start:Optional[str] = None, end:Optional[str] = None, batch:int = 256) -> AsyncIterator[Tuple[str, Any]]:
+		"""iterate documents ordered by key, optionally only those starting with prefix or in range [start, end)"""
+		async for key, val in self._driver._scan(self.table, prefix, start, end, batch):
+			yield key, val
+
+	@contextmanager
+	def transaction(self) -> Iterator['AddonStorage']:
+		try:
+			with self._driver.transaction():
+				yield self
+		except Exception:
+			self._cache.clear()  # may contain values which were never committed
+			raise
+
+	def cache_stats(self) -> Dict[str, int]:
+		return {
+			"size": len(self._cache),
+			"capacity": self.cache_size,
+			"hits": self.hits,
+			"misses": self.misses,
+		}
+
+class StorageDriver:
+	name : str
+	backend : StorageBackend
+	write_behind : bool
+	flush_interval : float
+	flush_threshold : int
+	write_latency : Histogram
+	logger : logging.Logger
+
+	_pending_lock : threading.Lock
+	_pending : Dict[str, Dict[str, Document]]
+	_flushing : Dict[str, Dict[str, Document]]
+	_staged : Optional[Dict[str, Dict[str, Document]]]
+	_transaction_depth : int
+	_pending_count : int
+	_write_lock : threading.Lock
+	_wakeup : threading.Event
+	_flusher : Optional[threading.Thread]
+	_closed : bool
+
+	def __init__(
+		self,
+		name:str,
+		write_behind:bool = False,
+		flush_interval:float = 1.0,
+		flush_threshold:int = 256,
+		journal_mode:str = "wal",
+		synchronous:str = "normal",
+		namespace:str = "",
+		pool_size:int = 4,
+		backend:Optional[StorageBackend] = None,
+	):
+		self.name = name
+		self.write_behind = write_behind
+		self.flush_interval = flush_interval
+		self.flush_threshold = flush_threshold
+		self.write_latency = Histogram("storage_write_latency", help="seconds to commit a batch of documents")
+		self.logger = logging.getLogger("storage")
+		self._pending_lock = threading.Lock()
+		self._pending = {}
+		self._flushing = {}
+		self._staged = None
+		self._transaction_depth = 0
+		self._pending_count = 0
+		self._write_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._flusher = None
+		self._closed = True  # nothing to close until backend is ready
+		self.backend = backend or SqliteBackend(
+			name,
+			namespace=namespace,
+			pool_size=pool_size,
+			journal_mode=journal_mode,
+			synchronous=synchronous,
+		)
+		self._closed = False
+		if self.write_behind:  # buffered documents are written by a background thread
+			self._flusher = threading.Thread(target=self._flush_worker, name=f"flusher[{name}]", daemon=True)
+			self._flusher.start()
+
+	def __del__(self):
+		self.close()
 
+	def close(self) -> None:
+		if self._closed:
+			return
+		self._closed = True
+		if self._flusher is not None:
+			self._wakeup.set()
+			self._flusher.join()
+		try:
+			self.flush()
+		finally:
+			self.backend.close()
+
+	@property
+	def schema_version(self) -> int:
+		return getattr(self.backend, "schema_version", len(MIGRATIONS))
+
+	@property
+	def db(self) -> sqlite3.Connection:
+		"""raw sqlite connection, kept for addons still issuing their own queries"""
+		if not isinstance(self.backend, SqliteBackend):
+			raise AttributeError(f"{type(self.backend).__name__} has no sqlite connection")
+		return self.backend.db
+
+	def _set_state(self, state:SystemState):
+		self.backend.set_system(state)
+
+	def _set_auth(self, state:AuthenticatorState):
+		self.backend.set_auth(state)
+
+	def migrate_addon_documents(self, addons:Iterable[str]) -> int:
+		"""move legacy '<addon>_<key>' documents of given addons into their own tables, returns how many were moved.
+		Other documents are left alone, since core ones may contain underscores too"""
+		moved : Dict[str, Dict[str, Document]] = {}
+		seen = set()
+		for addon in sorted(set(addons), key=len, reverse=True):  # 'a_b_key' belongs to addon 'a_b' rather than 'a'
+			if not addon.isidentifier() or not NAMESPACE_MATCHER.match(addon):
+				raise ValueError(f"Invalid addon name '{addon}'")
+			prefix = f"{addon}_"
+			docs : Dict[str, Document] = {}
+			lower, inclusive = prefix, True
+			while True:
+				rows = self.backend.scan("documents", lower, inclusive, _prefix_end(prefix), 256)
+				for key, doc in rows:
+					if key not in seen:
+						seen.add(key)
+						docs[key[len(prefix):]] = doc
+				if len(rows) < 256:
+					break
+				lower, inclusive = rows[-1][0], False
+			if docs:
+				self.backend.create_table(f"documents_{addon}")
+				moved[f"documents_{addon}"] = docs
+		if not moved:
+			return 0
+		moved["documents"] = { key: None for key in seen }
+		self.backend.write(moved)  # all together, a failure leaves everything where it was
+		return len(seen)
+
+	def addon_storage(self, name:str, cache_size:int = 0, codec:Codec = JSON) -> AddonStorage:
+		return AddonStorage(self, name, cache_size=cache_size, codec=codec)
+
+	def system(self) -> Optional[SystemState]:
+		return self.backend.system()
+
+	def auth(self) -> Optional[AuthenticatorState]:
+		return self.backend.auth()
+
+	def _buffered(self, table:str, key:str) -> Tuple[bool, Document]:
+		if self._staged is not None and key in self._staged.get(table, ()):
+			return True, self._staged[table][key]
+		if self.write_behind:
+			with self._pending_lock:  # newest values may not be in the database yet
+				for buffer in (self._pending, self._flushing):
+					if table in buffer and key in buffer[table]:
+						return True, buffer[table][key]
+		return False, None
 
+	def _get(self, table:str, key:str) -> Optional[Any]:
+		found, doc = self._buffered(table, key)
+		if found:
+			return _decode(doc)
+		return _decode(self.backend.get(table, [key]).get(key))
+
+	def _get_many(self, table:str, keys:List[str]) -> Dict[str, Optional[Any]]:
+		res : Dict[str, Optional[Any]] = {}
+		missing = []
+		for key in keys:
+			found, doc = self._buffered(table, key)
+			if found:
+				res[key] = _decode(doc)
+			else:
+				res[key] = None
+				missing.append(key)
+		if missing:
+			for key, doc in self.backend.get(table, missing).items():
+				res[key] = _decode(doc)
+		return res
+
+	def _put(self, table:str, key:str, val:Any, codec:Codec = JSON) -> None:
+		self._write(table, { key: (codec.encode(val), codec.tag) })
+
+	def _write(self, table:str, docs:Dict[str, Document]) -> None:
+		if self._staged is not None:
+			if table not in self._staged:
+				self._staged[table] = {}
+			self._staged[table].update(docs)
+			return
+		if self.write_behind:
+			self._buffer({ table: docs })
+			return
+		self._commit({ table: docs })
+
+	def _buffer(self, batch:Dict[str, Dict[str, Document]]) -> None:
+		with self._pending_lock:  # all at once, so the flusher never commits only part of a transaction
+			for table, docs in batch.items():
+				if table not in self._pending:
+					self._pending[table] = {}
+				self._pending[table].update(docs)
+				self._pending_count += len(docs)
+			if self._pending_count >= self.flush_threshold:
+				self._wakeup.set()
+
+	def _commit(self, batch:Dict[str, Dict[str, Document]]) -> None:
+		start = perf_counter()
+		self.backend.write(batch)
+		self.write_latency.observe(perf_counter() - start)
+
+	@contextmanager
+	def transaction(self) -> Iterator[None]:
+		"""writes made inside this block are only applied, all together, when it exits without errors.
+		Don't await inside it: writes from other tasks would end up in the same transaction"""
+		if self._staged is None:
+			self._staged = {}
+		self._transaction_depth += 1
+		try:
+			yield
+		except BaseException:
+			self._transaction_depth -= 1
+			if not self._transaction_depth:
+				self._staged = None
+			raise
+		self._transaction_depth -= 1
+		if self._transaction_depth:
+			return  # nested block, outermost one will commit
+		staged, self._staged = self._staged, None
+		if self.write_behind:
+			self._buffer(staged)
+			return
+		self._commit(staged)
+
+	async def _scan(self, table:str, prefix:str, start:Optional[str], end:Optional[str], batch:int) -> AsyncIterator[Tuple[str, Any]]:
+		if self.write_behind:
+			self.flush()  # ranges are read from backend only
+		lower, inclusive = max(start or "", prefix), True
+		upper = _prefix_end(prefix)
+		if end is not None:
+			upper = min(end, upper) if upper is not None else end
+		while True:
+			rows = self.backend.scan(table, lower, inclusive, upper, batch)
+			for key, doc in rows:
+				yield key, _decode(doc)
+			if len(rows) < batch:
+				return
+			lower, inclusive = rows[-1][0], False
+			await asyncio.sleep(0)  # let other tasks run between batches
+
+	def _flush_worker(self):
+		while not self._closed:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+			except Exception:  # documents are kept buffered, next flush retries them
+				self.logger.exception("Could not flush buffered documents of '%s'", self.name)
+
+	def flush(self) -> None:
+		"""write all buffered documents in a single transaction, safe to call from any thread"""
+		if not self.write_behind:
+			return
+		with self._write_lock:
+			with self._pending_lock:
+				self._flushing, self._pending = self._pending, {}
+				self._pending_count = 0
+				batch = self._flushing
+			if not batch:
+				return
+			try:
+				self._commit(batch)
+			except BaseException:
+				with self._pending_lock:  # put them back, under anything written meanwhile
+					for table, docs in batch.items():
+						self._pending[table] = { **docs, **self._pending.get(table, {}) }
+					self._pending_count = sum(len(docs) for docs in self._pending.values())
+					self._flushing = {}
+				raise
+			with self._pending_lock:
+				self._flushing = {}
+
+	def get(self, key:str) -> Optional[Any]:
+		return self._get("documents", key)
+
+	def put(self, key:str, val:Any) -> None:
+		self._put("documents", key, val)
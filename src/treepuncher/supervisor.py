@@ -0,0 +1,207 @@
+import asyncio
+import logging
+
+try:
+	import resource
+except ImportError:  # not available on windows
+	resource = None  # type: ignore
+
+from enum import Enum
+from time import process_time
+from typing import Dict, List, Optional, Callable, Any
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from .traits import Runnable
+from .treepuncher import Treepuncher, MissingParameterError
+
+class ClientState(Enum):
+	IDLE = "idle"
+	STARTING = "starting"
+	RUNNING = "running"
+	STOPPING = "stopping"
+	STOPPED = "stopped"
+	FAILED = "failed"
+
+class ClientHandle:
+	name : str
+	client : Optional[Treepuncher]
+	state : ClientState
+	error : Optional[str]
+	fatal : bool
+	starts : int
+
+	def __init__(self, name:str):
+		self.name = name
+		self.client = None
+		self.state = ClientState.IDLE
+		self.error = None
+		self.fatal = False
+		self.starts = 0
+
+	def stats(self) -> Dict[str, Any]:
+		res : Dict[str, Any] = { "state": self.state.value, "starts": self.starts }
+		if self.error:
+			res["error"] = self.error
+		if self.client is not None:
+			queues = self.client.queue_stats().values()
+			res["tasks"] = len(self.client._tasks)
+			res["queued"] = sum(q["depth"] for q in queues)
+			res["dropped"] = sum(q["dropped"] for q in queues)
+			res["world_bytes"] = self.client.world.memory_usage()
+		return res
+
+ClientFactory = Callable[..., Treepuncher]
+
+class Supervisor(Runnable):
+	"""runs many clients concurrently on the same event loop, sharing scheduler and storage.
+	Clients are built by factory(name, **kwargs), so addons can be installed on each"""
+	factory : ClientFactory
+	clients : Dict[str, ClientHandle]
+	scheduler : AsyncIOScheduler
+	storage : Optional[str]
+	stats_interval : float
+	logger : logging.Logger
+
+	_client_kwargs : Dict[str, Any]
+	_watcher : Optional[asyncio.Task]
+
+	def __init__(
+		self,
+		names:List[str],
+		factory:ClientFactory = Treepuncher,
+		storage:Optional[str] = None,  # shared session file, clients keep their own by default
+		stats_interval:float = 300.0,
+		**kwargs
+	):
+		super().__init__()
+		self.factory = factory
+		self.clients = { name: ClientHandle(name) for name in names }
+		self.storage = storage
+		self.stats_interval = stats_interval
+		self.logger = logging.getLogger("supervisor")
+		self.scheduler = AsyncIOScheduler()
+		self.scheduler.start(paused=True)
+		self._client_kwargs = kwargs
+		self._watcher = None
+
+	def _build(self, handle:ClientHandle) -> Treepuncher:
+		kwargs = dict(self._client_kwargs)
+		if self.storage:  # each client gets its own namespace in one shared file
+			kwargs.setdefault("storage_shared", self.storage)
+		return self.factory(handle.name, scheduler=self.scheduler, **kwargs)
+
+	async def start_client(self, name:str):
+		handle = self.clients.setdefault(name, ClientHandle(name))
+		if handle.state in (ClientState.STARTING, ClientState.RUNNING):
+			return
+		handle.state = ClientState.STARTING
+		handle.error = None
+		handle.fatal = False
+		handle.starts += 1
+		try:
+			if handle.client is None:
+				handle.client = self._build(handle)
+			await handle.client.start()
+			handle.state = ClientState.RUNNING
+		except MissingParameterError as e:
+			self.logger.error("Could not start client '%s' : %s", name, str(e))
+			handle.state = ClientState.FAILED
+			handle.error = str(e)
+			handle.fatal = True
+			handle.client = None
+		except Exception as e:  # one broken client shouldn't bring down the others
+			self.logger.exception("Could not start client '%s'", name)
+			handle.state = ClientState.FAILED
+			handle.error = str(e)
+			handle.client = None
+
+	async def stop_client(self, name:str, force:bool = False):
+		handle = self.clients[name]
+		if handle.client is None:
+			return
+		if handle.state not in (ClientState.STARTING, ClientState.RUNNING) \
+			and not (force and handle.state is ClientState.STOPPING):  # escalating a graceful stop
+			return
+		handle.state = ClientState.STOPPING
+		try:
+			await handle.client.stop(force=force)
+			handle.state = ClientState.STOPPED
+		except Exception as e:
+			self.logger.exception("Exception stopping client '%s'", name)
+			handle.state = ClientState.FAILED
+			handle.error = str(e)
+
+	async def restart_client(self, name:str):
+		await self.stop_client(name)
+		self.clients[name].client = None  # build it again, re-reading its configuration
+		await self.start_client(name)
+
+	@property
+	def misconfigured(self) -> bool:
+		"""every client stopped because of its configuration or credentials, restarting won't help"""
+		return all(h.fatal for h in self.clients.values())
+
+	def stats(self) -> Dict[str, Any]:
+		clients = { name: handle.stats() for name, handle in self.clients.items() }
+		usage = resource.getrusage(resource.RUSAGE_SELF) if resource is not None else None
+		return {
+			"clients": len(clients),
+			"running": sum(1 for c in clients.values() if c["state"] == ClientState.RUNNING.value),
+			"failed": sum(1 for c in clients.values() if c["state"] == ClientState.FAILED.value),
+			"tasks": len(asyncio.all_tasks()),
+			"queued": sum(c.get("queued", 0) for c in clients.values()),
+			"world_bytes": sum(c.get("world_bytes", 0) for c in clients.values()),
+			"max_rss_kb": usage.ru_maxrss if usage is not None else 0,
+			"cpu_seconds": usage.ru_utime + usage.ru_stime if usage is not None else process_time(),
+			"per_client": clients,
+		}
+
+	def report(self) -> str:
+		stats = self.stats()
+		lines = [
+			f"{stats['running']}/{stats['clients']} clients running ({stats['failed']} failed), "
+			f"{stats['tasks']} tasks, {stats['queued']} queued callbacks, "
+			f"{stats['world_bytes'] // 1024} KiB of chunks, {stats['max_rss_kb'] // 1024} MiB peak rss"
+		]
+		for name, c in stats["per_client"].items():
+			lines.append(f"  {name}: {c['state']}" + (f" ({c['error']})" if "error" in c else ""))
+		return '\n'.join(lines)
+
+	async def _watch(self):
+		elapsed = 0.0
+		while self._is_running:
+			await asyncio.sleep(1)
+			for handle in self.clients.values():  # clients stop by themselves on fatal errors
+				if handle.state is ClientState.RUNNING and handle.client is not None and not handle.client._is_running:
+					self.logger.warning("Client '%s' stopped", handle.name)
+					handle.state = ClientState.STOPPED
+					if handle.client._fatal_error is not None:
+						handle.error = handle.client._fatal_error
+						handle.fatal = True
+			if not any(h.state in (ClientState.STARTING, ClientState.RUNNING) for h in self.clients.values()):
+				self.logger.error("All clients stopped")
+				return await self.stop()
+			elapsed += 1
+			if self.stats_interval > 0 and elapsed >= self.stats_interval:
+				elapsed = 0.0
+				self.logger.info("Fleet status: %s", self.report())
+
+	async def start(self):
+		await super().start()
+		await asyncio.gather(*(self.start_client(name) for name in list(self.clients)))
+		self.scheduler.resume()
+		self._watcher = asyncio.get_event_loop().create_task(self._watch())
+		self.logger.info("Supervisor started")
+		if not any(h.state is ClientState.RUNNING for h in self.clients.values()):
+			self.logger.error("No client could be started")
+			await self.stop(force=True)
+
+	async def stop(self, force:bool = False):
+		self.scheduler.pause()
+		await asyncio.gather(*(self.stop_client(name, force=force) for name in list(self.clients)))
+		if self._watcher is not None and self._watcher is not asyncio.current_task():
+			self._watcher.cancel()
+		self._watcher = None
+		await super().stop()
+		self.logger.info("Supervisor stopped")
@@ -1,3 +1,3 @@
-from .callbacks import CallbacksHolder
+from .callbacks import CallbacksHolder, CallbackQueue, OverflowPolicy
 from .runnable import Runnable
 
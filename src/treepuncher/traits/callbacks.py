@@ -1,50 +1,383 @@
+import sys
 import asyncio
-import uuid
 import logging
 
-from inspect import isclass
-from typing import Dict, List, Set, Any, Callable, Type
+from enum import Enum
+from collections import deque
+from contextlib import contextmanager
+from inspect import isclass, iscoroutinefunction
+from itertools import count
+from time import perf_counter
+from typing import Dict, List, Set, Tuple, Deque, Optional, Any, Callable, Type, Iterator, Coroutine
+
+from ..metrics import Histogram
+
+# tasks can start eagerly since python 3.12, before that inline coroutines are scheduled as usual
+EAGER_TASKS = sys.version_info >= (3, 12)
+
+class OverflowPolicy(Enum):
+	BLOCK = "block"
+	DROP_OLDEST = "drop-oldest"
+	DROP_NEWEST = "drop-newest"
+	COALESCE = "coalesce"
+
+class CallbackQueue:
+	name : str
+	maxsize : int
+	concurrency : int
+	policy : OverflowPolicy
+	coalesce_key : Optional[Callable[[Callable, tuple], Any]]
+	latency : Optional[Histogram]
+
+	processed : int
+	dropped : int
+	coalesced : int
+	peak : int
+
+	_pending : Deque[list]
+	_keys : Dict[Any, list]
+	_active : int
+	_overflowing : bool
+	_workers : List[asyncio.Task]
+	_wakeup : Optional[asyncio.Event]
+	_space : Optional[asyncio.Event]
+	_idle : Optional[asyncio.Event]
+
+	def __init__(
+		self,
+		name:str,
+		maxsize:int = 1024,
+		concurrency:int = 1,
+		policy:OverflowPolicy = OverflowPolicy.BLOCK,
+		coalesce_key:Optional[Callable[[Callable, tuple], Any]] = None,
+	):
+		if policy is OverflowPolicy.COALESCE and coalesce_key is None:
+			# no generic key is safe: two chat messages are both ChatEvents, yet neither replaces the other
+			raise ValueError(f"Callback queue '{name}' uses coalesce policy but has no coalesce_key")
+		self.name = name
+		self.maxsize = maxsize
+		self.concurrency = max(concurrency, 1)
+		self.policy = policy
+		self.coalesce_key = coalesce_key
+		self.latency = None
+		self.processed = 0
+		self.dropped = 0
+		self.coalesced = 0
+		self.peak = 0
+		self._pending = deque()
+		self._keys = {}
+		self._active = 0
+		self._overflowing = False
+		self._workers = []
+		self._wakeup = None
+		self._space = None
+		self._idle = None
+
+	@property
+	def depth(self) -> int:
+		return len(self._pending)
+
+	@property
+	def full(self) -> bool:
+		return self.maxsize > 0 and len(self._pending) >= self.maxsize
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			"depth": len(self._pending),
+			"peak": self.peak,
+			"active": self._active,
+			"processed": self.processed,
+			"dropped": self.dropped,
+			"coalesced": self.coalesced,
+		}
+
+	def _start(self):
+		self._wakeup = asyncio.Event()
+		self._space = asyncio.Event()
+		self._idle = asyncio.Event()
+		loop = asyncio.get_event_loop()
+		self._workers = [ loop.create_task(self._work()) for _ in range(self.concurrency) ]
+
+	def _overflow(self):
+		if not self._overflowing:
+			self._overflowing = True
+			logging.warning("Callback queue '%s' is full, applying policy '%s'", self.name, self.policy.value)
+
+	def put(self, cb:Callable, args:tuple) -> bool:
+		"""enqueue a callback invocation, returns False if the producer should wait for some space"""
+		if not self._workers:
+			self._start()
+		entry = [cb, args]
+		if self.full:
+			if self.policy is OverflowPolicy.DROP_NEWEST:
+				self._overflow()
+				self.dropped += 1
+				return True
+			if self.policy is OverflowPolicy.COALESCE:
+				key = self.coalesce_key(cb, args)  # type: ignore
+				if key is not None and key in self._keys:  # replace arguments of pending invocation, keeping its place in line
+					self._keys[key][1] = args
+					self.coalesced += 1
+					return True
+			if self.policy is not OverflowPolicy.BLOCK:  # nothing to coalesce with, make room
+				self._overflow()
+				self._forget(self._pending.popleft())
+				self.dropped += 1
+		if self.policy is OverflowPolicy.COALESCE:
+			key = self.coalesce_key(cb, args)  # type: ignore
+			if key is not None:  # None means this invocation never replaces, nor is replaced by, another
+				self._keys[key] = entry
+		self._pending.append(entry)
+		self.peak = max(self.peak, len(self._pending))
+		self._wakeup.set()
+		return self.policy is not OverflowPolicy.BLOCK or not self.full
+
+	def _forget(self, entry:list):
+		if self.policy is OverflowPolicy.COALESCE:
+			key = self.coalesce_key(entry[0], entry[1])  # type: ignore
+			if key is not None and self._keys.get(key) is entry:
+				self._keys.pop(key)
+
+	async def wait_space(self):
+		while self.full:
+			self._space.clear()
+			await self._space.wait()
+
+	async def join(self):
+		while self._workers and (self._pending or self._active):
+			self._idle.clear()
+			await self._idle.wait()
+
+	async def close(self):
+		for w in self._workers:
+			w.cancel()
+		await asyncio.gather(*self._workers, return_exceptions=True)
+		self._workers = []
+
+	async def _work(self):
+		while True:
+			while not self._pending:
+				self._wakeup.clear()
+				await self._wakeup.wait()
+			entry = self._pending.popleft()
+			self._forget(entry)
+			if not self.full:
+				self._space.set()
+			if not self._pending:
+				self._overflowing = False
+			cb, args = entry
+			self._active += 1
+			start = perf_counter()
+			try:
+				res = cb(*args)
+				if asyncio.iscoroutine(res):
+					await res
+			except Exception:
+				logging.exception("Exception processing callback '%s'", cb.__name__)
+			finally:
+				if self.latency is not None:
+					self.latency.observe(perf_counter() - start)
+				self._active -= 1
+				self.processed += 1
+				if not self._pending and not self._active:
+					self._idle.set()
 
 class CallbacksHolder:
 
 	_callbacks : Dict[Any, List[Callable]]
-	_tasks : Dict[uuid.UUID, asyncio.Task]
+	_priority : Dict[Any, List[Callable]]
+	_dispatch : Dict[Any, Tuple[Callable, ...]]
+	_inline : Set[Callable]
+	_queues : Dict[Callable, CallbackQueue]
+	_congested : Set[CallbackQueue]
+	_default_queue : Optional[CallbackQueue]
+	_tasks : Dict[int, asyncio.Task]
+	_task_ids : Iterator[int]
+	callback_latency : Histogram
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self._callbacks = {}
+		self._priority = {}
+		self._dispatch = {}
+		self._inline = set()
+		self._queues = {}
+		self._congested = set()
+		self._default_queue = None
 		self._tasks = {}
+		self._task_ids = count()
+		self.callback_latency = Histogram("callback_latency", help="seconds from callback invocation to completion")
 
 	def callback_keys(self, filter:Type | None = None) -> Set[Any]:
-		return set(x for x in self._callbacks.keys() if not filter or (isclass(x) and issubclass(x, filter)))
+		keys = set(self._callbacks.keys()) | set(self._priority.keys())
+		return set(x for x in keys if not filter or (isclass(x) and issubclass(x, filter)))
+
+	@contextmanager
+	def queued_callbacks(self, queue:Optional[CallbackQueue]):
+		prev = self._default_queue
+		self._default_queue = queue
+		try:
+			yield queue
+		finally:
+			self._default_queue = prev
 
-	def register(self, key:Any, callback:Callable):
+	def queue_stats(self) -> Dict[str, Dict[str, int]]:
+		return { q.name: q.stats() for q in set(self._queues.values()) }
+
+	def register(
+		self,
+		key:Any,
+		callback:Callable,
+		inline:bool = False,
+		queue:Optional[CallbackQueue] = None,
+		coalesce:Optional[Callable[..., Any]] = None,
+		priority:bool = False,
+	):
+		if priority:  # always run inline as soon as key is triggered, never queued nor coalesced
+			if key not in self._priority:
+				self._priority[key] = []
+			self._priority[key].append(callback)
+			return callback
+		queue = queue or self._default_queue
+		if queue is not None:
+			self._queues[callback] = queue
+			if queue.latency is None:
+				queue.latency = self.callback_latency
+		elif inline or not iscoroutinefunction(callback):
+			self._inline.add(callback)  # sync callbacks never need a task
+		handler = callback
+		if coalesce is not None:
+			handler = self._coalescing(callback, coalesce)
+			self._inline.add(handler)
 		if key not in self._callbacks:
 			self._callbacks[key] = []
-		self._callbacks[key].append(callback)
+		self._callbacks[key].append(handler)
+		self._dispatch.clear()
 		return callback
 
-	def trigger(self, key:Any) -> List[Callable]:
-		if key not in self._callbacks:
-			return []
-		return self._callbacks[key]
+	def _coalescing(self, cb:Callable, key:Callable[..., Any]) -> Callable:
+		# only deliver the newest arguments for each key, once per event loop iteration.
+		# A None key means never merged, like in CallbackQueue: those are delivered right away
+		latest : Dict[Any, tuple] = {}
+
+		def flush():
+			batch = list(latest.values())
+			latest.clear()
+			for args in batch:
+				self._invoke(cb, *args)
+
+		def collect(*args):
+			k = key(*args)
+			if k is None:
+				self._invoke(cb, *args)
+				return
+			if not latest:
+				asyncio.get_event_loop().call_soon(flush)
+			latest[k] = args
+
+		collect.__name__ = cb.__name__
+		collect.__qualname__ = cb.__qualname__
+		collect.__module__ = cb.__module__
+		return collect
+
+	def _compile(self, key:Any) -> Tuple[Callable, ...]:
+		if isclass(key):  # also route to listeners of any base class, most specific first
+			handlers = tuple(cb for k in key.__mro__ for cb in self._callbacks.get(k, ()))
+		else:
+			handlers = tuple(self._callbacks.get(key, ()))
+		self._dispatch[key] = handlers
+		return handlers
+
+	def compile_callbacks(self):
+		self._dispatch.clear()
+		for key in self._callbacks:
+			self._compile(key)
 
-	def _wrap(self, cb:Callable, uid:uuid.UUID) -> Callable:
-		async def wrapper(*args):
+	def trigger(self, key:Any) -> Tuple[Callable, ...]:
+		handlers = self._dispatch.get(key)
+		if handlers is None:  # first time we see this key, resolve it once and cache it
+			handlers = self._compile(key)
+		return handlers
+
+	def _wrap(self, cb:Callable, coro:Coroutine, uid:int, start:float) -> Coroutine:
+		async def wrapper():
 			try:
-				return await cb(*args)
+				return await coro
 			except Exception:
 				logging.exception("Exception processing callback '%s'", cb.__name__)
 				return None
 			finally:
-				self._tasks.pop(uid)
-		return wrapper
+				self._tasks.pop(uid, None)
+				self.callback_latency.observe(perf_counter() - start)
+		return wrapper()
+
+	def _spawn(self, cb:Callable, coro:Coroutine, start:Optional[float] = None, eager:bool = False) -> None:
+		task_id = next(self._task_ids)
+		wrapped = self._wrap(cb, coro, task_id, start if start is not None else perf_counter())
+		loop = asyncio.get_event_loop()
+		if eager and EAGER_TASKS:  # runs right away until it first suspends, but in its own task
+			task = asyncio.Task(wrapped, loop=loop, eager_start=True)  # type: ignore
+			if task.done():
+				return  # completed without ever suspending, nothing to track
+		else:
+			task = loop.create_task(wrapped)
+		self._tasks[task_id] = task
+
+	def _run_inline(self, cb:Callable, *args) -> None:
+		start = perf_counter()
+		try:
+			res = cb(*args)
+		except Exception:
+			logging.exception("Exception processing callback '%s'", cb.__name__)
+			res = None
+		if asyncio.iscoroutine(res):
+			# coroutines always get a real task: current_task(), timeouts and TaskGroups must see their own
+			self._spawn(cb, res, start, eager=True)
+			return
+		self.callback_latency.observe(perf_counter() - start)
+
+	def _invoke(self, cb:Callable, *args) -> None:
+		queue = self._queues.get(cb)
+		if queue is not None:
+			if not queue.put(cb, args):
+				self._congested.add(queue)
+		elif cb in self._inline:
+			self._run_inline(cb, *args)
+		else:
+			self._spawn(cb, cb(*args))
+
+	def run_priority_callbacks(self, key:Any, *args) -> None:
+		for cb in self._priority.get(key, ()):
+			self._run_inline(cb, *args)
 
 	def run_callbacks(self, key:Any, *args) -> None:
 		for cb in self.trigger(key):
-			task_id = uuid.uuid4()
-			self._tasks[task_id] = asyncio.get_event_loop().create_task(self._wrap(cb, task_id)(*args))
+			self._invoke(cb, *args)
+
+	def run_unqueued_callbacks(self, key:Any, *args) -> bool:
+		"""run callbacks not going through an addon queue, True if any was skipped because it does"""
+		skipped = False
+		for cb in self.trigger(key):
+			if cb in self._queues:
+				skipped = True
+			else:
+				self._invoke(cb, *args)
+		return skipped
+
+	def run_queued_callbacks(self, key:Any, *args) -> None:
+		for cb in self.trigger(key):
+			if cb in self._queues:
+				self._invoke(cb, *args)
+
+	async def wait_congested(self):
+		while self._congested:
+			await self._congested.pop().wait_space()
 
 	async def join_callbacks(self):
 		await asyncio.gather(*list(self._tasks.values()))
+		for queue in set(self._queues.values()):
+			await queue.join()
 
+	async def close_queues(self):
+		for queue in set(self._queues.values()):
+			await queue.close()
@@ -38,6 +38,7 @@ class Runnable:
 
 
 		signal(SIGINT, signal_handler)
+		signal(SIGTERM, signal_handler)
 
 		async def main():
 			await self.start()
@@ -4,7 +4,7 @@ import asyncio
 import datetime
 import pkg_resources
 
-from typing import Any, Type
+from typing import Any, Type, Optional
 from time import time
 from configparser import ConfigParser
 
@@ -14,16 +14,26 @@ from aiocraft.packet import Packet
 from aiocraft.auth import AuthInterface, AuthException, MojangAuthenticator, MicrosoftAuthenticator, OfflineAuthenticator
 from aiocraft.auth.microsoft import InvalidStateError
 
-from .storage import StorageDriver, SystemState, AuthenticatorState
+from .storage import StorageDriver, SystemState, AuthenticatorState, namespace_for
 from .game import GameState, GameChat, GameInventory, GameTablist, GameWorld, GameContainer
 from .addon import Addon
 from .notifier import Notifier, Provider
+from .metrics import Counter, MetricsServer
 
 __VERSION__ = pkg_resources.get_distribution('treepuncher').version
 
+async def _initialize(m: Addon, l: logging.Logger):
+	try:  # a broken addon shouldn't prevent others from starting
+		await m.initialize()
+	except Exception:
+		l.exception("Exception initializing addon %s", m.name)
+
 async def _cleanup(m: Addon, l: logging.Logger):
-	await m.cleanup()
-	l.debug("Cleaned up addon %s", m.name)
+	try:
+		await m.cleanup()
+		l.debug("Cleaned up addon %s", m.name)
+	except Exception:
+		l.exception("Exception cleaning up addon %s", m.name)
 
 class MissingParameterError(Exception):
 	pass
@@ -44,9 +54,16 @@ class Treepuncher(
 	scheduler: AsyncIOScheduler
 	modules: list[Addon]
 	ctx: dict[Any, Any]
+	reconnects: Counter
+	connection_errors: Counter
 
 	_processing: bool
+	_owns_scheduler: bool
 	_proto_override: int
+	_metrics_host: str
+	_metrics_port: int
+	_metrics_server: Optional[MetricsServer]
+	_fatal_error: Optional[str]
 	_host: str
 	_port: int
 
@@ -54,6 +71,7 @@ class Treepuncher(
 		self,
 		name: str,
 		config_file: str = "",
+		scheduler: Optional[AsyncIOScheduler] = None,
 		**kwargs
 	):
 		self.ctx = dict()
@@ -111,15 +129,41 @@ class Treepuncher(
 		else:
 			self._host, self._port = self.resolve_srv(self._host)
 
-		self.storage = StorageDriver(opt('session_file') or f"data/{name}.session")  # TODO wrap with pathlib
+		shared_storage = opt('storage_shared')  # one database for many clients, each in its own namespace
+		self.storage = StorageDriver(
+			shared_storage or opt('session_file') or f"data/{name}.session",  # TODO wrap with pathlib
+			namespace=opt('storage_namespace', default=namespace_for(name)) if shared_storage else "",
+			pool_size=opt('storage_pool_size', default=4, t=int),
+			write_behind=opt('storage_write_behind', default=False, t=bool),
+			flush_interval=opt('storage_flush_interval', default=1.0, t=float),
+			flush_threshold=opt('storage_flush_threshold', default=256, t=int),
+			journal_mode=opt('storage_journal_mode', default="wal"),
+			synchronous=opt('storage_synchronous', default="normal"),
+		)
 
 		self.notifier = Notifier(self)
 
+		self.metrics.labels["client"] = name
+		self.metrics.add(self.storage.write_latency)
+		self.metrics.add(self.notifier.sent)
+		self.metrics.add(self.notifier.failed)
+		self.metrics.add(self.notifier.latency)
+		self.reconnects = self.metrics.counter("reconnects_total", help="connections made after the first one")
+		self.connection_errors = self.metrics.counter("connection_errors_total", help="connection attempts failed with an error")
+		self._metrics_host = opt('metrics_host', default="127.0.0.1")
+		self._metrics_port = opt('metrics_port', default=0, t=int)  # 0 disables the http endpoint
+		self._metrics_server = None
+		self._fatal_error = None  # set when stopping because of an error that retrying won't fix
+		if opt('metrics_report', default=False, t=bool):
+			self.notifier.add_reporter(self.metrics.report)
+
 		self.modules = []
 
-		self.scheduler = AsyncIOScheduler()
+		self._owns_scheduler = scheduler is None  # a shared scheduler is started and paused by its owner
+		self.scheduler = scheduler or AsyncIOScheduler()
 		logging.getLogger('apscheduler.executors.default').setLevel(logging.WARNING)  # So it's way less spammy
-		self.scheduler.start(paused=True)
+		if self._owns_scheduler:
+			self.scheduler.start(paused=True)
 
 		prev = self.storage.system()  # if this isn't 1st time, this won't be None. Load token from there
 		state = SystemState(self.name, __VERSION__, 0)
@@ -167,18 +211,26 @@ class Treepuncher(
 		await self.notifier.start()
 		self.logger.debug("Notifier started")
 		await asyncio.gather(
-			*(m.initialize() for m in self.modules)
+			*(_initialize(m, self.logger) for m in self.modules)
 		)
 		self.logger.debug("Addons initialized")
+		self.compile_callbacks()
+		if self._metrics_port:
+			try:  # clients in this process share the endpoint
+				self._metrics_server = await MetricsServer.attach(self.metrics, self._metrics_port, host=self._metrics_host)
+			except OSError as e:
+				self.logger.error("Could not serve metrics on port %d : %s", self._metrics_port, str(e))
 		self._processing = True
 		self._worker = asyncio.get_event_loop().create_task(self._work())
-		self.scheduler.resume()
+		if self._owns_scheduler:
+			self.scheduler.resume()
 		self.logger.info("Treepuncher started")
 		self.storage._set_state(SystemState(self.name, __VERSION__, time()))
 
 	async def stop(self, force: bool = False):
 		self._processing = False
-		self.scheduler.pause()
+		if self._owns_scheduler:
+			self.scheduler.pause()
 		if self.dispatcher.connected:
 			await self.dispatcher.disconnect(block=not force)
 		if not force:
@@ -186,12 +238,19 @@ class Treepuncher(
 			self.logger.debug("Joined worker")
 			await self.join_callbacks()
 			self.logger.debug("Joined callbacks")
+		await self.close_queues()  # also when forced, or their workers would keep this client alive
+		if not force:
 			await asyncio.gather(
 				*(_cleanup(m, self.logger) for m in self.modules)
 			)
 			self.logger.debug("Cleaned up addons")
 			await self.notifier.stop()
 			self.logger.debug("Notifier stopped")
+		self.storage.flush()
+		self.logger.debug("Storage flushed")
+		if self._metrics_server is not None:
+			await self._metrics_server.detach(self.metrics)
+			self._metrics_server = None
 		await super().stop()
 		self.logger.info("Treepuncher stopped")
 
@@ -209,7 +268,16 @@ class Treepuncher(
 		self.logger.debug("Worker started")
 		try:
 			log_ignored_packets = self.cfg.getboolean('log_ignored_packets', fallback=False)
-			whitelist = self.callback_keys(filter=Packet)
+			# only packets in whitelist get deserialized, everything else is skipped as raw bytes
+			ignored = set(n.strip() for n in self.cfg.get('ignore_packets', fallback='').split(',') if n.strip())
+			whitelist = set(p for p in self.callback_keys(filter=Packet) if p.__name__ not in ignored)
+			for packet_type in self.callback_keys(filter=Packet) - whitelist:
+				handlers = self._callbacks.get(packet_type, []) + self._priority.get(packet_type, [])
+				self.logger.warning(
+					"ignore_packets disables handlers of %s : %s", packet_type.__name__,
+					", ".join(f"{getattr(cb, '__module__', '')}.{getattr(cb, '__qualname__', repr(cb))}" for cb in handlers)
+				)
+			self.logger.debug("Decoding %d packet types", len(whitelist))
 			if self._proto_override:
 				proto = self._proto_override
 			else:
@@ -220,10 +288,15 @@ class Treepuncher(
 				except OSError as e:
 					self.logger.error("Connection error : %s", str(e))
 
+			first = True
 			while self._processing:
+				if not first:
+					self.reconnects.inc()
+				first = False
 				try:
 					await self.join(self._host, self._port, proto, whitelist=whitelist, log_ignored_packets=log_ignored_packets)
 				except OSError as e:
+					self.connection_errors.inc()
 					self.logger.error("Connection error : %s", str(e))
 
 				if self._processing: # don't sleep if Treepuncher is stopping
@@ -231,8 +304,10 @@ class Treepuncher(
 
 		except AuthException as e:
 			self.logger.error("Auth exception : [%s|%d] %s (%s)", e.endpoint, e.code, e.data, e.kwargs)
+			self._fatal_error = f"auth failed : {e.data}"
 		except InvalidStateError:
 			self.logger.error("Invalid authenticator state")
+			self._fatal_error = "invalid authenticator state"
 			if isinstance(self.authenticator, MicrosoftAuthenticator):
 				self.logger.info("Obtain an auth code by visiting %s", self.authenticator.url())
 		except Exception as e:
@@ -0,0 +1,32 @@
+import asyncio
+
+from treepuncher.game.chat_queue import ChatQueue, ChatPriority
+
+def _queue(sent, maxsize:int = 2) -> ChatQueue:
+	async def send(text:str):
+		sent.append(text)
+	return ChatQueue(send, lambda: False, rate=0, max_length=10, maxsize=maxsize)
+
+def test_evicted_split_message_is_cancelled():
+	async def run():
+		sent = []
+		queue = _queue(sent)
+		split = queue.put("aaaa bbbb cccc", priority=ChatPriority.LOW)
+		urgent = queue.put("help", priority=ChatPriority.HIGH)
+		await asyncio.sleep(0)
+		assert split.cancelled()
+		assert not urgent.done()
+		assert [ e[2] for e in queue._heap ] == [ "help" ]
+		await queue.close()
+	asyncio.run(run())
+
+def test_close_cancels_split_message():
+	async def run():
+		sent = []
+		queue = _queue(sent, maxsize=8)
+		split = queue.put("aaaa bbbb cccc")
+		await queue.close()
+		await asyncio.sleep(0)
+		assert split.cancelled()
+		assert not sent
+	asyncio.run(run())